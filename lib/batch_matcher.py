@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Match keywords against all websites of one or more CSVs in one process
+
+If several groups are given, a URL that is monitored by more than one group is
+downloaded and parsed only once, and the outputs of every group are written to
+a sub-directory of the output directory named after the CSV.
+
+Usage:
+  batch_matcher.py (--csv <path> --keywords <path> --group <group>)... [--hashes <dir>] [--hash-format <format>] [--cache <dir>] [--output <dir>] [--shard <index/count>] [--workers <num>] [--host-concurrency <num>] [--delay <seconds>] [--parser <name>] [--pdf-cache <dir>] [--deadline <seconds>] [--max-pages <num>] [--max-bytes <num>] [--max-response-bytes <num>] [--scope <scope>] [--probe] [--tabs <num>] [--verbose] [--no-verify]
+  batch_matcher.py (-h | --help)
+  batch_matcher.py --version
+
+Options:
+  -h, --help                    Show this screen.
+  --version                     Show version.
+  -c, --csv <path>              CSV with the websites (label,active,slug,error_count,url,timeout,type).
+  -k, --keywords <path>         Load the keywords from file.
+  -g, --group <group>           Label of the group of URLs.
+  --hashes <dir>                Directory with the hash files of all slugs [default: hashes].
+  --hash-format <format>        Format of the hash files, txt or bin (compact binary format) [default: txt].
+  --cache <dir>                 Directory with the page cache files of all slugs [default: cache].
+  -o, --output <dir>            Directory for matches/, new_hashes/, new_cache/, status/, metrics/ and error_counts/ [default: .].
+  --shard <index/count>         Only check every count-th active URL, starting with URL index (0-based) [default: 0/1].
+  --workers <num>               Number of pages that are fetched concurrently [default: 4].
+  --host-concurrency <num>      Maximum number of concurrent requests per host [default: 2].
+  --delay <seconds>             Minimum delay between two requests to the same host [default: 1].
+  --parser <name>               HTML parser: html.parser, lxml or stream (only extracts texts and links) [default: html.parser].
+  --pdf-cache <dir>             Keep the texts of converted PDFs in this directory.
+  --deadline <seconds>          Stop the crawl of a website after this many seconds (unless set in the CSV).
+  --max-pages <num>             Stop the crawl of a website after this many fetched pages (unless set in the CSV).
+  --max-bytes <num>             Stop the crawl of a website after this many downloaded bytes (unless set in the CSV).
+  --max-response-bytes <num>    Skip pages that are larger than this many bytes (unless set in the CSV).
+  --scope <scope>               Links that are followed: any, host or prefix (unless set in the CSV) [default: any].
+  --probe                       Check links with unknown file extensions with a HEAD request first (unless set in the CSV).
+  --tabs <num>                  Maximum number of pages rendered concurrently with Selenium [default: 2].
+  --verbose                     Option to enable more verbose output.
+  --no-verify                   Option to disable SSL verification for requests.
+"""  # noqa: E501
+
+import os
+import csv
+import logging
+import sys
+from docopt import docopt
+import urllib3
+import download as dl
+import pdf_text
+from budget import LIMITS, CrawlBudget, budget_options
+from link_filter import LinkFilter, link_filter_options
+from crawler import Crawler, check_website, load_keywords, render_options
+from fetch_cache import FetchCache
+from hash_store import load_hash_store
+from page_cache import PageCache, keywords_fingerprint
+from page_parser import check_parser
+from scheduler import HostLimiter, Scheduler
+
+log = logging.getLogger(__name__)
+
+
+def load_rows(path):
+    with open(path, newline="") as f:
+        return [row for row in csv.DictReader(f) if row["active"] == "yes"]
+
+
+def shard_rows(rows, shard):
+    index, count = (int(i) for i in shard.split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard: {shard}")
+    return rows[index::count]
+
+
+def load_targets(specs, hashes_dir, cache_dir, output_dir):
+    """All (group, keywords, dirs, row) targets of the (csv, keywords, group) specs"""
+    targets = []
+    for csv_path, keywords_path, group in specs:
+        group_output_dir = output_dir
+        if len(specs) > 1:
+            csv_name = os.path.splitext(os.path.basename(csv_path))[0]
+            group_output_dir = os.path.join(output_dir, csv_name)
+        dirs = (hashes_dir, cache_dir, group_output_dir)
+        keywords = load_keywords(keywords_path)
+        targets.extend((group, keywords, dirs, row) for row in load_rows(csv_path))
+    return targets
+
+
+def group_by_url(targets):
+    """Group the targets by URL, in the order of the first occurence
+
+    All targets of a URL end up in the same shard and are checked one after
+    another, so the fetch cache can serve the pages to all of them.
+    """
+    by_url = {}
+    for target in targets:
+        by_url.setdefault(target[-1]["url"], []).append(target)
+    return list(by_url.values())
+
+
+def output_path(output_dir, kind, filename):
+    path = os.path.join(output_dir, kind)
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, filename)
+
+
+def check_row(
+    row,
+    group,
+    keywords,
+    dirs,
+    hash_format="txt",
+    limits=None,
+    scope=None,
+    probe=False,
+    **kwargs,
+):
+    hashes_dir, cache_dir, output_dir = dirs
+    slug = row["slug"]
+    log.info(f"Check website «{row['label']}» ({group}/{slug}): {row['url']}")
+    hashes = load_hash_store(os.path.join(hashes_dir, f"{slug}.{hash_format}"))
+    page_cache = PageCache.load(
+        os.path.join(cache_dir, f"{slug}.jsonl"),
+        fingerprint=keywords_fingerprint(keywords),
+    )
+    options = render_options(
+        row.get("ready"), row.get("selector"), row.get("block_resources")
+    )
+    # limits in the CSV override the ones of the command line
+    limits = limits or {}
+    budget = CrawlBudget(
+        **budget_options(**{k: row.get(k) or limits.get(k) for k in LIMITS})
+    )
+    crawler = Crawler(
+        group,
+        keywords,
+        hashes,
+        timeout=int(row["timeout"]),
+        dl_type=row["type"],
+        page_cache=page_cache,
+        budget=budget,
+        link_filter=LinkFilter(
+            verify=kwargs.get("verify", True),
+            **link_filter_options(
+                row.get("scope") or scope,
+                row.get("include"),
+                row.get("exclude"),
+                row.get("probe") or probe,
+            ),
+        ),
+        **options,
+        **kwargs,
+    )
+    check_website(
+        crawler,
+        row["url"],
+        row["label"],
+        output_path(output_dir, "matches", f"{slug}.jsonl"),
+        output_path(output_dir, "new_hashes", f"{slug}.{hash_format}"),
+        output_path(output_dir, "new_cache", f"{slug}.jsonl"),
+        output_path(output_dir, "status", f"{slug}.json"),
+        output_path(output_dir, "metrics", f"{slug}.jsonl"),
+    )
+
+
+def setup_logging(verbose=False):
+    loglevel = logging.INFO
+    if verbose:
+        log.setLevel(logging.DEBUG)
+        logging.getLogger("crawler").setLevel(logging.DEBUG)
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)-8s %(message)s",
+        level=loglevel,
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    logging.captureWarnings(True)
+
+
+def row_options(arguments):
+    """Options of check_row that are the same for all rows"""
+    hash_format = arguments["--hash-format"]
+    if hash_format not in ("txt", "bin"):
+        raise ValueError(f"Invalid hash format: {hash_format}")
+    limits = {k: arguments[f"--{k.replace('_', '-')}"] for k in LIMITS}
+    budget_options(**limits)
+    return {
+        "verify": not arguments["--no-verify"],
+        "parser": check_parser(arguments["--parser"]),
+        "hash_format": hash_format,
+        "limits": limits,
+        "scope": link_filter_options(arguments["--scope"])["scope"],
+        "probe": arguments["--probe"],
+    }
+
+
+def check_targets(url_targets, **options):
+    """Check all targets, returns the number of checked and the failed targets"""
+    checked = 0
+    failed = []
+    for group_targets in url_targets:
+        # pages of URLs that are monitored by several groups are only fetched
+        # once, every page is dropped after the last of them has used it
+        fetch_cache = None
+        if len(group_targets) > 1:
+            fetch_cache = FetchCache(users=len(group_targets))
+        for group, keywords, dirs, row in group_targets:
+            checked += 1
+            try:
+                check_row(
+                    row, group, keywords, dirs, fetch_cache=fetch_cache, **options
+                )
+            except Exception:
+                # note the error for later, but check all other rows
+                log.exception(f"Error when checking {group}/{row['slug']}")
+                failed.append((group, row))
+                error_path = output_path(dirs[2], "error_counts", f"{row['slug']}.txt")
+                open(error_path, "a").close()
+        if fetch_cache is not None:
+            fetch_cache.log_stats()
+    return checked, failed
+
+
+def main(arguments):
+    setup_logging(arguments["--verbose"])
+    options = row_options(arguments)
+    if not options["verify"]:
+        urllib3.disable_warnings()
+
+    specs = list(zip(arguments["--csv"], arguments["--keywords"], arguments["--group"]))
+    targets = load_targets(
+        specs, arguments["--hashes"], arguments["--cache"], arguments["--output"]
+    )
+    url_targets = shard_rows(group_by_url(targets), arguments["--shard"])
+
+    # HTTP connections, browsers and the per-host limits are shared by all rows
+    limiter = HostLimiter(
+        max_concurrent=int(arguments["--host-concurrency"]),
+        delay=float(arguments["--delay"]),
+    )
+    scheduler = Scheduler(workers=int(arguments["--workers"]))
+    dl.configure_browser_pool(max_tabs=int(arguments["--tabs"]))
+    if arguments["--pdf-cache"]:
+        pdf_text.configure_cache(directory=arguments["--pdf-cache"])
+
+    try:
+        checked, failed = check_targets(
+            url_targets,
+            scheduler=scheduler,
+            limiter=limiter,
+            **options,
+        )
+    finally:
+        scheduler.shutdown()
+        dl.browser_pool.close()
+        pdf_text.cache.close()
+        dl.log_pool_stats()
+
+    log.info(f"Checked {checked} websites, {len(failed)} failed")
+    if failed:
+        names = ", ".join(f"{group}/{row['slug']}" for group, row in failed)
+        log.warning(f"Checking failed for: {names}")
+    # like in check_websites.yml, only a repeated error of a website is reported,
+    # a single one is just counted in its error_count by update_state.py
+    repeated = [
+        f"{group}/{row['slug']}"
+        for group, row in failed
+        if int(row.get("error_count") or 0) > 0
+    ]
+    if repeated:
+        raise Exception(f"Checking failed again for: {', '.join(repeated)}")
+
+
+try:
+    main(docopt(__doc__, version="Match websites in batch 1.0"))
+except Exception:
+    log.exception("Error in batch_matcher.py")
+    sys.exit(1)
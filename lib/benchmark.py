@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the crawler offline against the local fixture server
+
+Every scenario runs `website_matcher.py` (crawl, match and hash stages) on one
+section of the synthetic site of `fixture_server.py` and measures the pages
+and bytes per second, the CPU time and the peak memory of the process. With
+--baseline, the results are compared with an earlier run (saved with --save)
+and the command fails if a scenario got slower or uses more memory.
+
+Usage:
+  benchmark.py run [--scenario <name>]... [--baseline <path>] [--save <path>] [--threshold <factor>] [--keep <dir>] [--verbose]
+  benchmark.py serve [--port <port>] [--verbose]
+  benchmark.py (-h | --help)
+  benchmark.py --version
+
+Options:
+  -h, --help                    Show this screen.
+  --version                     Show version.
+  --scenario <name>             Only run these scenarios (default: all).
+  --baseline <path>             Compare the results with this JSON file.
+  --save <path>                 Save the results to a JSON file, e.g. as new baseline.
+  --threshold <factor>          Results that are this many times worse than the baseline are regressions [default: 1.5].
+  --keep <dir>                  Keep the output of the runs in this directory (default: a temporary directory).
+  --port <port>                 Port of the fixture server [default: 8765].
+  --verbose                     Option to enable more verbose output.
+"""  # noqa: E501
+
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from docopt import docopt
+import fixture_server
+
+log = logging.getLogger(__name__)
+
+WEBSITE_MATCHER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "website_matcher.py"
+)
+# path of the start page, the scenario whose hashes and cache are used and
+# the programs that are needed
+SCENARIOS = {
+    "listing": {"path": "/listing/"},
+    "listing-cached": {"path": "/listing/", "previous": "listing"},
+    "pdf": {"path": "/pdf/", "requires": ("pdfinfo", "pdftotext")},
+    "slow": {"path": "/slow/"},
+    "throttled": {"path": "/throttled/"},
+    "redirects": {"path": "/redirects/"},
+}
+# no politeness delay, the fixture server is local
+MATCHER_OPTIONS = ["--delay", "0", "--host-concurrency", "4", "--workers", "4"]
+# higher is better for rates, lower is better for everything else
+RATES = ("pages_per_second", "bytes_per_second")
+COSTS = ("cpu_seconds", "peak_rss_mb")
+# differences below these values are noise, not regressions
+MIN_DIFFERENCE = {
+    "pages_per_second": 1,
+    "bytes_per_second": 10 * 1024,
+    "cpu_seconds": 0.5,
+    "peak_rss_mb": 10,
+}
+
+
+def children_cpu_seconds():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def run_record(metrics_path):
+    """The last record of a metrics file, the summary of the run"""
+    with open(metrics_path) as f:
+        lines = f.read().splitlines()
+    return json.loads(lines[-1]) if lines else {}
+
+
+def count_lines(path):
+    try:
+        with open(path) as f:
+            return sum(1 for _ in f)
+    except FileNotFoundError:
+        return 0
+
+
+def run_scenario(name, base_url, workdir, keywords_path):
+    scenario = SCENARIOS[name]
+    previous = scenario.get("previous", name)
+
+    def path(kind, scenario_name, extension):
+        os.makedirs(os.path.join(workdir, kind), exist_ok=True)
+        return os.path.join(workdir, kind, f"{scenario_name}.{extension}")
+
+    cmd = [
+        sys.executable,
+        WEBSITE_MATCHER,
+        "--url", base_url + scenario["path"],
+        "--label", name,
+        "--group", "Benchmark",
+        "--keywords", keywords_path,
+        "--file", path("hashes", previous, "txt"),
+        "--new", path("hashes", name, "txt"),
+        "--cache", path("cache", previous, "jsonl"),
+        "--new-cache", path("cache", name, "jsonl"),
+        "--output", path("matches", name, "jsonl"),
+        "--status", path("status", name, "json"),
+        "--metrics", path("metrics", name, "jsonl"),
+    ] + MATCHER_OPTIONS  # fmt: skip
+    if previous == name:
+        # start without the hashes and the cache of an earlier run
+        for stale in (path("hashes", name, "txt"), path("cache", name, "jsonl")):
+            if os.path.exists(stale):
+                os.remove(stale)
+    log.info(f"Run scenario {name}: {base_url}{scenario['path']}")
+    cpu_start = children_cpu_seconds()
+    start = time.monotonic()
+    with open(path("logs", name, "log"), "w") as log_file:
+        subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT, check=True)
+    seconds = time.monotonic() - start
+
+    status = read_json(path("status", name, "json"))
+    run = run_record(path("metrics", name, "jsonl"))
+    crawl_seconds = max(status["seconds"], 0.001)
+    return {
+        "pages": status["pages"],
+        "bytes": status["bytes"],
+        "matches": count_lines(path("matches", name, "jsonl")),
+        "complete": status["complete"],
+        "seconds": round(seconds, 3),
+        "pages_per_second": round(status["pages"] / crawl_seconds, 2),
+        "bytes_per_second": round(status["bytes"] / crawl_seconds),
+        "cpu_seconds": round(children_cpu_seconds() - cpu_start, 3),
+        "peak_rss_mb": status.get("peak_rss_mb"),
+        "stages": run.get("stages", {}),
+        "counters": run.get("counters", {}),
+    }
+
+
+def available(name):
+    missing = [p for p in SCENARIOS[name].get("requires", ()) if not shutil.which(p)]
+    if missing:
+        log.warning(f"Skip scenario {name}, {', '.join(missing)} not found")
+    return not missing
+
+
+def run_benchmark(names, workdir=None):
+    """Run the scenarios, the output is kept if `workdir` is set"""
+    if workdir is None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            return run_benchmark(names, tmp_dir)
+
+    os.makedirs(workdir, exist_ok=True)
+    keywords_path = os.path.join(workdir, "keywords.txt")
+    with open(keywords_path, "w") as f:
+        f.write("\n".join(fixture_server.KEYWORDS))
+    results = {}
+    with fixture_server.serve() as base_url:
+        for name in filter(available, names):
+            results[name] = run_scenario(name, base_url, workdir, keywords_path)
+    return results
+
+
+def regressions(results, baseline, threshold):
+    """(scenario, description) of all results that are worse than the baseline"""
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for key in ("pages", "matches"):
+            if result[key] != before[key]:
+                yield name, f"{key} changed: {before[key]} → {result[key]}"
+        for key in RATES + COSTS:
+            old, new = before.get(key), result.get(key)
+            if not old or not new or abs(new - old) < MIN_DIFFERENCE[key]:
+                continue
+            if (key in RATES and new * threshold < old) or (
+                key in COSTS and new > old * threshold
+            ):
+                yield name, f"{key}: {old:g} → {new:g}"
+
+
+def report(results, baseline=None, threshold=1.5):
+    lines = [
+        "## Benchmark",
+        "",
+        "| Scenario | Pages | Matches | Seconds | Pages/s | KB/s | CPU s | Peak RSS MB "
+        "| Match s | Hash lookup s |",
+        "|---|---:|---:|---:|---:|---:|---:|---:|---:|---:|",
+    ]
+    for name, r in results.items():
+        stages = r["stages"]
+        lines.append(
+            f"| {name} | {r['pages']} | {r['matches']} | {r['seconds']:.1f} | "
+            f"{r['pages_per_second']:.1f} | {r['bytes_per_second'] / 1024:.0f} | "
+            f"{r['cpu_seconds']:.1f} | {r['peak_rss_mb'] or ''} | "
+            f"{stages.get('match', 0):.2f} | {stages.get('hash_lookup', 0):.3f} |"
+        )
+    found = []
+    if baseline is not None:
+        found = list(regressions(results, baseline, threshold))
+        lines += ["", f"### Regressions (more than {threshold:g}× worse)", ""]
+        lines += [f"* {name}: {text}" for name, text in found] or ["None"]
+    return "\n".join(lines), found
+
+
+try:
+    arguments = docopt(__doc__, version="Benchmark 1.0")
+
+    loglevel = logging.INFO
+    if arguments["--verbose"]:
+        loglevel = logging.DEBUG
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)-8s %(message)s",
+        level=loglevel,
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    logging.captureWarnings(True)
+
+    if arguments["serve"]:
+        with fixture_server.serve(int(arguments["--port"])) as base_url:
+            log.info(f"Serving the fixtures at {base_url}, stop with Ctrl-C")
+            while True:
+                time.sleep(1)
+
+    names = arguments["--scenario"] or list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = run_benchmark(names, arguments["--keep"])
+    baseline = read_json(arguments["--baseline"]) if arguments["--baseline"] else None
+    text, found = report(results, baseline, float(arguments["--threshold"]))
+    print(text)
+    if arguments["--save"]:
+        with open(arguments["--save"], "w") as f:
+            json.dump(results, f, indent=2)
+    if found:
+        raise Exception(f"{len(found)} regressions compared to the baseline")
+
+except KeyboardInterrupt:
+    log.info("Stopped.")
+except Exception:
+    log.exception("Error in benchmark.py")
+    sys.exit(1)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Limits of the crawl of one website
+
+A crawl stops as soon as the time since its start, the number of fetched pages
+or the number of downloaded bytes reaches its limit. Pages that are already
+fetched when a limit is reached are still matched, so the total can be a bit
+higher than the limit. A single response larger than `max_response_bytes` is
+skipped like any other page that can't be loaded.
+"""
+
+import threading
+import time
+import download as dl
+
+# limits that can be set on the command line or in the CSV, `None` is unlimited
+LIMITS = ("deadline", "max_pages", "max_bytes", "max_response_bytes")
+
+
+class BudgetExhausted(Exception):
+    """A limit of the crawl is reached, no more pages are fetched"""
+
+
+def budget_options(
+    deadline=None, max_pages=None, max_bytes=None, max_response_bytes=None
+):
+    """Limits of a crawl, empty values are unlimited"""
+    options = {
+        "deadline": float(deadline) if deadline else None,
+        "max_pages": int(max_pages) if max_pages else None,
+        "max_bytes": int(max_bytes) if max_bytes else None,
+        "max_response_bytes": int(max_response_bytes) if max_response_bytes else None,
+    }
+    for name, value in options.items():
+        if value is not None and value <= 0:
+            raise ValueError(f"Invalid {name}: {value}")
+    return options
+
+
+class CrawlBudget:
+    """Count the pages and bytes of a crawl and check them against the limits"""
+
+    def __init__(
+        self, deadline=None, max_pages=None, max_bytes=None, max_response_bytes=None
+    ):
+        self.deadline = deadline
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.max_response_bytes = max_response_bytes
+        self.pages = 0
+        self.bytes = 0
+        self.exhausted = None
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self._start = time.monotonic()
+            self.pages = self.bytes = 0
+            self.exhausted = None
+
+    def elapsed(self):
+        return time.monotonic() - self._start
+
+    def _exhausted(self):
+        if self.deadline is not None and self.elapsed() >= self.deadline:
+            return f"deadline of {self.deadline:g}s reached"
+        if self.max_pages is not None and self.pages >= self.max_pages:
+            return f"{self.max_pages} pages fetched"
+        if self.max_bytes is not None and self.bytes >= self.max_bytes:
+            return f"{self.max_bytes} bytes downloaded"
+        return None
+
+    def take_page(self):
+        """Count a page that is about to be fetched, raise if a limit is reached"""
+        with self._lock:
+            self.exhausted = self.exhausted or self._exhausted()
+            if self.exhausted:
+                raise BudgetExhausted(self.exhausted)
+            self.pages += 1
+
+    def add_bytes(self, size):
+        with self._lock:
+            self.bytes += size
+
+    def response_limit(self):
+        """Maximum size of a single response"""
+        if self.max_response_bytes is None:
+            return dl.MAX_CONTENT_SIZE
+        return min(self.max_response_bytes, dl.MAX_CONTENT_SIZE)
+
+    def status(self):
+        """Summary of the crawl, `complete` is false if it stopped early"""
+        return {
+            "complete": self.exhausted is None,
+            "reason": self.exhausted,
+            "pages": self.pages,
+            "bytes": self.bytes,
+            "seconds": round(self.elapsed(), 1),
+        }
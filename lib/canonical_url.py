@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Canonical form of URLs, to fetch every document of a crawl only once
+
+Links to the same document are often written differently: with a fragment,
+a default port, a trailing slash, tracking parameters (`utm_source` etc.), in
+another order of the query parameters or with http instead of https. All of
+them have the same canonical form, which is used as key of the visited set.
+Only hashbang fragments (`#!/route`) are kept, they are the routes of single
+page applications and therefore different documents.
+The URL that is actually fetched is always the one of the first link.
+"""
+
+import logging
+import urllib.parse
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+TRACKING_PREFIXES = ("utm_",)
+TRACKING_PARAMETERS = {
+    "_ga",
+    "_gl",
+    "dclid",
+    "fbclid",
+    "gbraid",
+    "gclid",
+    "igshid",
+    "mc_cid",
+    "mc_eid",
+    "msclkid",
+    "wbraid",
+    "yclid",
+}
+
+
+def _is_tracking(name):
+    name = name.lower()
+    return name in TRACKING_PARAMETERS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonicalize(url):
+    """Canonical form of a URL, it's still a valid URL of the same document"""
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host
+    if parts.username:
+        userinfo = parts.username
+        if parts.password:
+            userinfo += f":{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc += f":{port}"
+
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+    query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    query = sorted((k, v) for k, v in query if not _is_tracking(k))
+    fragment = parts.fragment if parts.fragment.startswith("!") else ""
+    return urllib.parse.urlunsplit(
+        (scheme, netloc, path, urllib.parse.urlencode(query), fragment)
+    )
+
+
+def url_key(url):
+    """Key of a URL in the visited set, http and https are the same document"""
+    canonical = canonicalize(url)
+    scheme, _, rest = canonical.partition("://")
+    return rest if scheme in DEFAULT_PORTS else canonical
+
+
+class VisitedSet:
+    """URLs of a crawl by their canonical form, counts the skipped duplicates"""
+
+    def __init__(self):
+        # canonical key -> first URL with this key
+        self._urls = {}
+        self.exact = 0
+        self.canonical = 0
+        self.redirects = 0
+        # URL -> canonical form of the URL it was redirected to
+        self.redirect_targets = {}
+
+    def __len__(self):
+        return len(self._urls)
+
+    def __iter__(self):
+        return iter(self._urls.values())
+
+    def __contains__(self, url):
+        return url_key(url) in self._urls
+
+    def add(self, url):
+        """Mark a URL as visited, returns False if it was already visited"""
+        key = url_key(url)
+        first_url = self._urls.get(key)
+        if first_url is None:
+            self._urls[key] = url
+            return True
+        if first_url == url:
+            self.exact += 1
+        else:
+            self.canonical += 1
+            log.debug(f"URL '{url}' is the same as '{first_url}'")
+        return False
+
+    def add_redirect(self, url, target):
+        """Mark the target of a redirect as visited
+
+        Returns False if the target was already visited from another URL, the
+        page then does not need to be processed again.
+        """
+        key = url_key(target) if target else None
+        if key is None or key == url_key(url):
+            return True
+        self.redirect_targets[url] = canonicalize(target)
+        if key not in self._urls:
+            self._urls[key] = target
+            return True
+        self.redirects += 1
+        log.debug(f"URL '{url}' redirects to the already visited '{target}'")
+        return False
+
+    def stats(self):
+        return {
+            "visited": len(self),
+            "duplicates": self.exact,
+            "canonical_duplicates": self.canonical,
+            "redirect_duplicates": self.redirects,
+        }
+
+    def log_stats(self):
+        log.info(
+            f"URL deduplication: {len(self)} URLs visited, saved "
+            f"{self.exact + self.canonical} fetches ({self.exact} identical URLs, "
+            f"{self.canonical} URLs with the same canonical form), "
+            f"{self.redirects} redirects to already visited pages"
+        )
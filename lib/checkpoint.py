@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Checkpoint of a crawl, to resume it after the process died
+
+The checkpoint is a JSON Lines file: the first line identifies the crawl (the
+start URL and the fingerprint of the keywords), followed by one record per
+crawled page with its result, its links (the frontier of the next level) and
+its entry in the page cache. Records are appended in batches, a line that was
+only partially written when the process died is ignored when loading. Like the
+visited set of the crawl, the records are keyed by `canonical_url.url_key`.
+
+The checkpoint is only valid for the same start URL, the same keywords and
+the same run (e.g. the GitHub run ID, so a retry of the run resumes, but the
+next scheduled run does not) and only for `max_age` seconds after the crawl
+was started, otherwise the crawl starts from scratch.
+"""
+
+import json
+import logging
+import os
+import time
+from canonical_url import canonicalize, url_key
+
+log = logging.getLogger(__name__)
+
+# records are written after this many pages or seconds, whatever comes first
+FLUSH_RECORDS = 20
+FLUSH_SECONDS = 30
+# older checkpoints are not resumed, the pages would be outdated
+MAX_AGE = 24 * 60 * 60
+
+
+def _line(record):
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+class Checkpoint:
+    """Crawled pages of a crawl, loaded from and appended to a file"""
+
+    def __init__(
+        self,
+        path,
+        url,
+        fingerprint="",
+        run_id=None,
+        max_age=MAX_AGE,
+        flush_records=FLUSH_RECORDS,
+        flush_seconds=FLUSH_SECONDS,
+    ):
+        self.path = path
+        self.header = {
+            "url": url,
+            "fingerprint": fingerprint,
+            "run_id": run_id,
+            "created": time.time(),
+        }
+        self.max_age = max_age
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self._records = {}
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    @classmethod
+    def open(cls, path, url, fingerprint="", resume=False, **kwargs):
+        """Load the checkpoint if `resume` is set, start a new one otherwise"""
+        checkpoint = cls(path, url, fingerprint, **kwargs)
+        if resume and checkpoint._load():
+            log.info(f"Resume crawl with {len(checkpoint)} pages from {path}")
+            return checkpoint
+        checkpoint._write([])
+        return checkpoint
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                if not self._valid_header(json.loads(f.readline())):
+                    return False
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        log.info("Skip incomplete record at the end of the checkpoint.")
+                        break
+                    self._records[url_key(record["url"])] = record
+        except (IOError, ValueError):
+            log.info(f"Checkpoint at {self.path} does not exist or is invalid.")
+            self._records.clear()
+            return False
+        # drop an incomplete last line, so new records start on a new line
+        self._write(self._records.values())
+        return True
+
+    def _valid_header(self, header):
+        keys = ("url", "fingerprint", "run_id")
+        if any(header.get(key) != self.header[key] for key in keys):
+            log.info("Checkpoint is from another crawl, start from scratch.")
+            return False
+        age = time.time() - header.get("created", 0)
+        if age > self.max_age:
+            log.info(f"Checkpoint is {age:.0f} seconds old, start from scratch.")
+            return False
+        # the age is counted from the start of the first crawl
+        self.header["created"] = header["created"]
+        return True
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, url):
+        """Record of an already crawled page, None if it's not crawled yet"""
+        return self._records.get(url_key(url))
+
+    def add(self, url, result, links, cache_entry=None):
+        record = {
+            "url": canonicalize(url),
+            "result": result,
+            "links": [list(link) for link in links] if links is not None else None,
+            "cache": cache_entry,
+        }
+        self._records[url_key(url)] = record
+        self._pending.append(record)
+        if (
+            len(self._pending) >= self.flush_records
+            or time.monotonic() - self._last_flush >= self.flush_seconds
+        ):
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        # one write per batch, so at most the last line can be incomplete
+        lines = "".join(_line(record) for record in self._pending)
+        with open(self.path, "a") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        log.debug(f"Checkpoint: {len(self._pending)} pages written")
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    def _write(self, records):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(_line(self.header))
+            f.writelines(_line(record) for record in records)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        """Remove the checkpoint of a finished crawl"""
+        self._pending = []
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
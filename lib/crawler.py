@@ -0,0 +1,715 @@
+# -*- coding: utf-8 -*-
+"""Crawl a website and match its content against keywords"""
+
+import collections
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import urllib.parse
+from pprint import pformat
+import jsonlines
+from requests.exceptions import RequestException
+from selenium.common.exceptions import WebDriverException
+import download as dl
+import pdf_text
+from budget import BudgetExhausted, CrawlBudget
+from canonical_url import VisitedSet
+from link_filter import LinkFilter
+from metrics import Metrics, TimedLookups, peak_rss_mb
+from page_cache import content_digest, text_fingerprint
+from page_parser import parse_html
+from scheduler import HostLimiter, Scheduler
+
+log = logging.getLogger(__name__)
+
+# pages on this level are not crawled anymore
+MAX_LEVEL = 2
+# maximum number of links that are followed per page
+LINK_LIMIT = 500
+
+# `size` is the number of downloaded bytes and `url` the URL after redirects
+FetchResult = collections.namedtuple(
+    "FetchResult",
+    ["content_type", "content", "digest", "validators", "not_modified", "size", "url"],
+)
+# parsed page, `texts` are the (string, text) tuples of the strings of an HTML
+# page (see page_parser) or the paragraphs of a PDF and `anchors` the
+# (href, string) tuples of the links
+Page = collections.namedtuple(
+    "Page", ["source_type", "texts", "text_digest", "title", "anchors"]
+)
+
+
+def load_keywords(path):
+    keywords = []
+    with open(path) as f:
+        keywords = [line.strip() for line in f if line.strip()]
+
+    regex_keywords = [
+        {"re": re.compile(rf"\b({k})\b", re.IGNORECASE), "keyword": k} for k in keywords
+    ]
+    return regex_keywords
+
+
+def match_texts(texts, keywords, old_hashes):
+    matches = []
+    for text in texts:
+        matched_keywords = list(filter(lambda k: k["re"].search(text), keywords))
+        if not matched_keywords:
+            continue
+
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        log.debug(f"Check against hash list to see if it's new: {text_hash}")
+
+        if text_hash in old_hashes:
+            log.debug("Text already known, no new match.")
+            continue
+
+        log.info("New match found!")
+        # add highlights to text
+        for k in matched_keywords:
+            m = k["re"].search(text)
+            short_text = text[max(0, m.start() - 70) : m.end() + 70]
+            hl_text = k["re"].sub(r"**\1**", short_text)
+            matches.append(
+                {
+                    "keyword": k["keyword"],
+                    "texts": [f"…{hl_text}…"],
+                    "hashes": [text_hash],
+                }
+            )
+
+    return matches
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_prefilter(patterns):
+    # backreferences would point to the wrong groups in a combined regex
+    if any(re.search(r"\\[1-9]|\(\?P=", p) for p in patterns):
+        return None
+    combined = "|".join(rf"\b(?:{p})\b" for p in patterns)
+    try:
+        return re.compile(combined, re.IGNORECASE)
+    except re.error:
+        log.debug("Keywords can't be combined to one regex, no prefilter used.")
+        return None
+
+
+def build_prefilter(keywords):
+    """Combine all keywords to one regex that finds all candidate texts"""
+    return _compile_prefilter(tuple(k["keyword"] for k in keywords))
+
+
+def _normalize_text(text):
+    text = text.strip()
+    text = text.replace("\n\n", "\n")
+    text = text.replace("\n", " ")
+    text = text.replace("  ", " ")
+    return text
+
+
+def match_html(texts, keywords, old_hashes):
+    # test all texts of the page only once and only test the candidate texts
+    # against every single keyword
+    prefilter = build_prefilter(keywords)
+    if prefilter:
+        candidates = [t for t in texts if prefilter.search(t[0])]
+    else:
+        candidates = texts
+    log.info(f"Check {len(keywords)} keywords against {len(candidates)} texts")
+
+    source_lists = [[] for _ in keywords]
+    source_hashes = [[] for _ in keywords]
+    for string, elem_text in candidates:
+        text = None
+        for i, kw_re in enumerate(keywords):
+            # the keywords are searched in the string, but the text is matched
+            if not kw_re["re"].search(string):
+                continue
+
+            if text is None:
+                text = _normalize_text(elem_text)
+                text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+                log.debug(f"Check against hash list to see if it's new: {text_hash}")
+            if text_hash in old_hashes:
+                log.info("Text already known, no new match.")
+                continue
+
+            if not re.search(r"\w", text):
+                log.info("Text has no word-characters in it, skipping...")
+                continue
+
+            log.info("New match found!")
+            # add highlights to text
+            m = kw_re["re"].search(text)
+            short_text = text[max(0, m.start() - 70) : m.end() + 70]
+            hl_text = kw_re["re"].sub(r"**\1**", short_text)
+            source_lists[i].append(f"…{hl_text}…")
+            source_hashes[i].append(text_hash)
+
+    matches = []
+    for kw_re, source_list, hashes in zip(keywords, source_lists, source_hashes):
+        unique_source_list = list(set(source_list))
+        if len(unique_source_list) > 0:
+            log.debug("Unique list:")
+            log.debug(pformat(unique_source_list))
+            matches.append(
+                {
+                    "keyword": kw_re["keyword"],
+                    "texts": unique_source_list,
+                    "hashes": hashes,
+                }
+            )
+    return matches
+
+
+def parse_page(content_type, content, parser="html.parser"):
+    """Parse a page once into the parts that are needed to match and crawl it"""
+    if "application/pdf" in content_type:
+        # the paragraphs of the PDF are read lazily from the extracted text
+        return Page("PDF", content, text_fingerprint(content), None, ())
+
+    parsed = parse_html(content, parser, link_limit=LINK_LIMIT)
+    return Page("HTML", parsed.texts, parsed.text_digest, parsed.title, parsed.anchors)
+
+
+def get_title(page, label):
+    try:
+        return page.title.strip() or label
+    except AttributeError:
+        return label
+
+
+def get_links(page, url, label):
+    # the anchors of a page are limited to 500 links with href attribute
+    for href, link_string in page.anchors:
+        # skip empty or anchor links, but not hashbang routes (#!/...)
+        if (
+            not href
+            or (href.startswith("#") and not href.startswith("#!"))
+            or href.startswith("mailto:")
+            or href.startswith("javascript:")
+        ):
+            continue
+        absolute_url = urllib.parse.urljoin(url, href)
+
+        link_text = link_string or label
+        yield (absolute_url, link_text.strip())
+
+
+class Crawler:
+    """Crawl a website and its sub-pages and match them against keywords
+
+    The HTTP client and the browser pool of the download module are shared by
+    all crawlers of a process, as well as the scheduler, the limiter and the
+    fetch cache, if the same instances are passed to several crawlers.
+    """
+
+    def __init__(
+        self,
+        group,
+        keywords,
+        old_hashes,
+        timeout=3,
+        dl_type="static",
+        verify=True,
+        scheduler=None,
+        limiter=None,
+        page_cache=None,
+        ready="fixed",
+        selector=None,
+        block_resources="all",
+        fetch_cache=None,
+        parser="html.parser",
+        budget=None,
+        checkpoint=None,
+        link_filter=None,
+        metrics=None,
+    ):
+        self.group = group
+        self.keywords = keywords
+        self.old_hashes = old_hashes
+        self.timeout = timeout
+        self.dl_type = dl_type
+        self.verify = verify
+        self.scheduler = scheduler or Scheduler()
+        self.limiter = limiter or HostLimiter()
+        self.page_cache = page_cache
+        self.ready = ready
+        self.selector = selector
+        self.block_resources = block_resources
+        self.fetch_cache = fetch_cache
+        self.parser = parser
+        self.budget = budget or CrawlBudget()
+        self.checkpoint = checkpoint
+        self.link_filter = link_filter or LinkFilter(verify=verify)
+        self.metrics = metrics or Metrics()
+        self.visited = VisitedSet()
+
+    def fetch_key(self, url):
+        """Key of a fetch, all options that change the content are part of it"""
+        key = (url, self.dl_type, self.verify, self.budget.response_limit())
+        if self.dl_type == "dynamic":
+            key += (self.timeout, self.ready, self.selector, self.block_resources)
+        return key
+
+    def get_content(self, url, headers=None):
+        self.budget.take_page()
+        if self.fetch_cache is None:
+            fetched = self.download(url, headers)
+        else:
+            fetched = self.fetch_cache.fetch(
+                self.fetch_key(url), headers, lambda h: self.download(url, h)
+            )
+        self.budget.add_bytes(fetched.size)
+        self.metrics.set(url, bytes=fetched.size)
+        return fetched
+
+    def parse(self, content_type, content, digest):
+        if self.fetch_cache is None or digest is None:
+            return parse_page(content_type, content, self.parser)
+        key = ("application/pdf" in content_type, digest, self.parser)
+        return self.fetch_cache.parse(
+            key, lambda: parse_page(content_type, content, self.parser)
+        )
+
+    def record_response(self, url, r):
+        """Metrics of a response: the time until the headers, status and retries"""
+        retries = getattr(r.raw, "retries", None)
+        self.metrics.add(url, "connect", r.elapsed.total_seconds())
+        self.metrics.set(
+            url,
+            status=r.status_code,
+            retries=len(retries.history) if retries is not None else 0,
+        )
+        self.metrics.count(f"status_{r.status_code}")
+
+    def fetch_response(self, url, headers, max_size):
+        """Fetch a page, a dynamic page that must be rendered has no content"""
+        metrics = self.metrics
+        with dl.fetch(url, verify=self.verify, max_size=max_size, headers=headers) as (
+            content_type,
+            r,
+        ):
+            self.record_response(url, r)
+            validators = dl.validators(r)
+            final_url = r.url
+            if r.status_code == dl.NOT_MODIFIED:
+                log.info(f"URL {url} not modified since last run")
+                return FetchResult(
+                    content_type, None, None, validators, True, 0, final_url
+                )
+            if "application/pdf" in content_type:
+                # PDFs are streamed to a file and converted in page ranges
+                with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+                    with metrics.timed(url, "download"):
+                        digest = dl.write_content(r, f, max_size)
+                    size = f.tell()
+                    with metrics.timed(url, "convert"):
+                        content = pdf_text.cache.text(digest, f.name)
+                return FetchResult(
+                    content_type, content, digest, validators, False, size, final_url
+                )
+            if self.dl_type == "dynamic":
+                return FetchResult(content_type, None, None, {}, False, 0, final_url)
+            if self.dl_type != "static":
+                raise Exception(f"Invalid type: {self.dl_type}")
+            with metrics.timed(url, "download"):
+                content = dl.read_content(r, max_size)
+            return FetchResult(
+                content_type,
+                content,
+                content_digest(content),
+                validators,
+                False,
+                len(content),
+                final_url,
+            )
+
+    def render(self, url, fetched, max_size):
+        """Load a dynamic page with Selenium, the digest is the rendered content"""
+        with self.metrics.timed(url, "render"):
+            content = dl.download_with_selenium(
+                url,
+                self.timeout,
+                ready=self.ready,
+                selector=self.selector,
+                block_resources=self.block_resources,
+            )
+        size = len(content.encode("utf-8"))
+        if size > max_size:
+            raise ValueError(f"Content larger than {max_size} bytes: {url}")
+        # no validators, they belong to the HTML shell, not the rendered page
+        return fetched._replace(
+            content=content, digest=content_digest(content), size=size
+        )
+
+    def download(self, url, headers=None):
+        log.info(f"Get content from URL {url}")
+        max_size = self.budget.response_limit()
+        metrics = self.metrics
+        try:
+            with self.limiter.slot(url) as waited:
+                metrics.add(url, "sleep", waited)
+                fetched = self.fetch_response(url, headers, max_size)
+                if fetched.content is None and not fetched.not_modified:
+                    # the response body is discarded, Selenium loads the page
+                    # on its own (in the same host slot, so the limits apply)
+                    fetched = self.render(url, fetched, max_size)
+            return fetched
+        except (RequestException, WebDriverException, ValueError) as e:
+            response = getattr(e, "response", None)
+            if response is not None:
+                self.record_response(url, response)
+            metrics.count("errors")
+            log.exception(f"Error when trying to request from URL: {url}")
+            raise ValueError(f"Error when trying to request from URL: {url}")
+
+    def request_headers(self, url, level):
+        # a 304 for the HTML shell of a dynamic page says nothing about the
+        # rendered content, the digest of the rendered page is compared instead
+        if self.page_cache is None or self.dl_type == "dynamic":
+            return None
+        return self.page_cache.request_headers(url, need_links=level + 1 < MAX_LEVEL)
+
+    def submit(self, url, level):
+        return self.scheduler.submit(
+            self.get_content, url, self.request_headers(url, level)
+        )
+
+    def probe(self, url):
+        """Check the content type of a link with an unknown extension"""
+        if not self.link_filter.needs_probe(url):
+            return True
+        with self.limiter.slot(url):
+            return self.link_filter.probe_allowed(url)
+
+    def filter_visited(self, links):
+        """Remove already crawled links and mark the remaining ones as visited"""
+        new_links = []
+        for absolute_url, link_label in links:
+            if not self.visited.add(absolute_url):
+                log.debug(f"URL '{absolute_url}' already crawled. Skipping...")
+                continue
+            new_links.append((absolute_url, link_label))
+        return new_links
+
+    def cached_links(self, url, fetched, need_links):
+        """Links of a page from the cache, if it did not change since the last run"""
+        if self.page_cache is None:
+            return None
+        entry = self.page_cache.lookup(
+            url, fetched.digest, fetched.not_modified, need_links
+        )
+        if entry is None:
+            return None
+
+        # the page did not change since the last run, so all matches are
+        # already known and only the stored links are needed
+        log.info(f"URL {url} unchanged since last run, skip matching")
+        self.metrics.count("unchanged_pages")
+        validators = {k: v or entry.get(k) for k, v in fetched.validators.items()}
+        self.page_cache.put(
+            url, entry["digest"], validators, entry["links"], entry.get("text_digest")
+        )
+        return [tuple(link) for link in entry["links"] or []]
+
+    def match_content(self, url, label, fetched, need_links):
+        """Match the content of a page
+
+        Returns the result, the links on the page and the fingerprint of the text.
+        """
+        with self.metrics.timed(url, "parse"):
+            page = self.parse(fetched.content_type, fetched.content, fetched.digest)
+        title = get_title(page, label)
+        text_digest = page.text_digest
+
+        links = list(get_links(page, url, label)) if need_links else None
+        if self.page_cache is not None and self.page_cache.text_unchanged(
+            url, text_digest, links
+        ):
+            log.info(f"Text and links of URL {url} unchanged, skip matching")
+            self.metrics.count("unchanged_texts")
+            matches = []
+        else:
+            matches = self.match_texts(url, page)
+
+        result = None
+        if matches:
+            result = {
+                "type": page.source_type,
+                "group": self.group,
+                "url": url,
+                "label": title,
+                "matches": matches,
+            }
+        return (result, links, text_digest)
+
+    def match_texts(self, url, page):
+        hashes = TimedLookups(self.old_hashes)
+        with self.metrics.timed(url, "match"):
+            if page.source_type == "PDF":
+                matches = match_texts(page.texts, self.keywords, hashes)
+                log.debug(f"Matches: {matches}")
+            else:
+                matches = match_html(page.texts, self.keywords, hashes)
+        self.metrics.add(url, "hash_lookup", hashes.seconds)
+        return matches
+
+    def match_page(self, url, label, fetched, need_links):
+        """Match a fetched page and update its entry in the cache"""
+        result, links, text_digest = self.match_content(url, label, fetched, need_links)
+        if self.page_cache is not None:
+            self.page_cache.put(
+                url, fetched.digest, fetched.validators, links, text_digest
+            )
+        return (result, links)
+
+    def crawl_page(self, url, label, fetched, need_links):
+        """Match a fetched page (unless it's unchanged) and add it to the checkpoint"""
+        if not self.visited.add_redirect(url, fetched.url):
+            log.info(f"URL {url} redirects to an already crawled page, skipping..")
+            return (None, [])
+        result = None
+        links = self.cached_links(url, fetched, need_links)
+        if links is None:
+            result, links = self.match_page(url, label, fetched, need_links)
+        if self.checkpoint is not None:
+            cache_entry = None
+            if self.page_cache is not None:
+                cache_entry = self.page_cache.entry(url)
+            self.checkpoint.add(url, result, links, cache_entry)
+        return (result, links)
+
+    def resumed(self, url, level):
+        """Checkpoint record of a page that was crawled by an earlier run"""
+        if self.checkpoint is None:
+            return None
+        record = self.checkpoint.get(url)
+        if record is None or (level + 1 < MAX_LEVEL and record["links"] is None):
+            return None
+        return record
+
+    def resume_page(self, url, record):
+        """Result and links of a page from the checkpoint"""
+        log.info(f"URL {url} already crawled by an earlier run")
+        self.metrics.count("resumed_pages")
+        if self.page_cache is not None and record["cache"]:
+            self.page_cache.restore(url, record["cache"])
+        result = record["result"]
+        if result:
+            # matches that were already written by the earlier run are known
+            matches = [
+                m
+                for m in result["matches"]
+                if not all(h in self.old_hashes for h in m["hashes"])
+            ]
+            result = {**result, "matches": matches} if matches else None
+        links = record["links"]
+        return (result, [tuple(link) for link in links] if links is not None else None)
+
+    def fetch_result(self, response, level):
+        try:
+            return response.result()
+        except ValueError:
+            if level == 0:
+                raise
+            # if a sub-page returns an error, silently ignore it
+            return None
+
+    def crawl_item(self, url, label, level, response):
+        """Fetch (or resume) and match a single page
+
+        Only the result and the (url, label) tuples of the links are returned,
+        the content and the parsed page are released before the sub-pages are
+        crawled.
+        """
+        record = self.resumed(url, level)
+        if record is not None:
+            return self.resume_page(url, record)
+        fetched = self.fetch_result(response, level)
+        if fetched is None:
+            return (None, None)
+        # links are only needed if the sub-pages are crawled as well
+        return self.crawl_page(url, label, fetched, level + 1 < MAX_LEVEL)
+
+    def fetch_links(self, links, level):
+        """Fetch the linked pages concurrently, yields (link, future) in order"""
+
+        def fetch(link):
+            # pages in the checkpoint are not fetched again
+            if self.resumed(link[0], level) is not None or not self.probe(link[0]):
+                return None
+            return self.get_content(link[0], self.request_headers(link[0], level))
+
+        return self.scheduler.map_ordered(
+            fetch,
+            self.filter_visited(
+                link for link in links if self.link_filter.allowed(link[0])
+            ),
+        )
+
+    def next_item(self, frontiers):
+        """Next page of the deepest frontier that is not crawled completely"""
+        while frontiers:
+            level, frontier = frontiers[-1]
+            item = next(frontier, None)
+            if item is not None:
+                (link_url, link_label), response = item
+                return (link_url, link_label, level, response)
+            frontiers.pop()
+        return None
+
+    def crawl_urls(self, url, label):
+        """Crawl a page and its sub-pages
+
+        The pages are crawled depth-first with an explicit work queue: a stack of
+        frontiers with the links of the pages whose sub-pages are crawled. The
+        sub-pages are fetched concurrently by the scheduler, but they are matched
+        one after another in the order of the links on the page, so the results
+        are the same as with a sequential crawl. Raises BudgetExhausted as soon
+        as a page can't be fetched within the budget. Pages in the checkpoint of
+        an earlier run are not fetched again.
+        """
+        if not url or not self.visited.add(url):
+            log.debug(f"URL '{url}' already crawled. Skipping...")
+            return
+        self.link_filter.start(url)
+        # the futures are only referenced by the item, so the fetched content
+        # can be released once the page is matched
+        frontiers = []
+        item = (url, label, 0, None if self.resumed(url, 0) else self.submit(url, 0))
+        try:
+            while item is not None:
+                level = item[2]
+                result, links = self.crawl_item(*item)
+                item = None
+                if result:
+                    yield result
+                if links and level + 1 < MAX_LEVEL:
+                    frontiers.append((level + 1, self.fetch_links(links, level + 1)))
+                item = self.next_item(frontiers)
+        finally:
+            for _, frontier in frontiers:
+                frontier.close()
+
+
+def render_options(ready=None, selector=None, block_resources=None):
+    """Options for dynamic pages, empty values are replaced by the defaults"""
+    selector = selector or None
+    ready = ready or ("selector" if selector else "fixed")
+    if ready not in dl.READY_STRATEGIES:
+        raise ValueError(f"Invalid readiness strategy: {ready}")
+    block_resources = block_resources or "all"
+    if block_resources not in dl.BLOCK_MODES:
+        raise ValueError(f"Invalid resource blocking mode: {block_resources}")
+    return {"ready": ready, "selector": selector, "block_resources": block_resources}
+
+
+def write_metrics(crawler, url, metrics_path):
+    """Write the metrics of the crawl, with the counters of the caches"""
+    metrics = crawler.metrics
+    page_cache = crawler.page_cache
+    if page_cache is not None:
+        metrics.count("page_cache_hits", page_cache.hits)
+        metrics.count("page_cache_misses", page_cache.misses)
+    for reason, n in crawler.link_filter.skipped.items():
+        metrics.count(f"links_skipped_{reason.replace(' ', '_')}", n)
+    visited = crawler.visited.stats()
+    metrics.count("duplicate_links", visited["duplicates"])
+    metrics.count("canonical_duplicate_links", visited["canonical_duplicates"])
+    status = crawler.budget.status()
+    metrics.write(metrics_path, url=url, complete=status["complete"])
+
+
+def write_status(crawler, url, status_path=None):
+    status = {
+        "url": url,
+        **crawler.budget.status(),
+        **crawler.visited.stats(),
+        "links_skipped": dict(crawler.link_filter.skipped),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    log.info(f"Crawl status: {status}")
+    if status_path:
+        with open(status_path, "w") as f:
+            json.dump(status, f)
+
+
+def write_matches(crawler, url, label, output):
+    """Crawl a website and write its results to output, until the budget is used up"""
+    hashes = crawler.old_hashes
+    try:
+        written_to_file = False
+        with jsonlines.open(output, mode="w") as writer:
+            try:
+                for result in crawler.crawl_urls(url, label):
+                    for match in result["matches"]:
+                        hashes.update(match["hashes"])
+
+                    log.debug("Match result:")
+                    log.debug(pformat(result))
+                    writer.write(result)
+                    written_to_file = True
+            except BudgetExhausted as e:
+                log.warning(f"Crawl of {url} stopped early: {e}")
+    except ValueError:
+        # make sure to remove the created file if there was an error and no write
+        # occured because the existence of this file indicates a successful check
+        if not written_to_file:
+            log.error("Error occured when crawling the website, deleting output file")
+            os.remove(output)
+        raise
+
+
+def check_website(
+    crawler,
+    url,
+    label,
+    output,
+    new_path,
+    new_cache_path=None,
+    status_path=None,
+    metrics_path=None,
+):
+    """Crawl a website and write the matches, the new hashes and the cache
+
+    If the budget of the crawler is used up, the crawl stops and everything that
+    was found so far is written, the status file then marks the crawl as partial.
+    The checkpoint of the crawler is removed once the crawl is complete.
+    """
+    hashes = crawler.old_hashes
+    checkpoint = crawler.checkpoint
+    crawler.budget.start()
+    try:
+        write_matches(crawler, url, label, output)
+    finally:
+        if checkpoint is not None:
+            checkpoint.flush()
+
+    log.info("Write new hash file...")
+    hashes.persist(new_path)
+    new_hashes_str = "\n".join(hashes.added)
+    log.info(f"{len(hashes)} hashes in total, new hashes: {new_hashes_str}")
+
+    page_cache = crawler.page_cache
+    if page_cache is not None:
+        page_cache.log_stats()
+        if new_cache_path:
+            log.info("Write new cache file...")
+            page_cache.persist(new_cache_path)
+
+    url_str = "\n".join(crawler.visited)
+    log.info(f"All checked URLs: {url_str}")
+    crawler.visited.log_stats()
+    crawler.link_filter.log_stats()
+
+    write_status(crawler, url, status_path)
+    if metrics_path:
+        write_metrics(crawler, url, metrics_path)
+    if checkpoint is not None and crawler.budget.exhausted is None:
+        checkpoint.remove()
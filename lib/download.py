@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
+import atexit
+import contextlib
+import hashlib
 import logging
 import requests
+import threading
 import time
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.chrome.options import Options
 from selenium_stealth import stealth
 import subprocess
@@ -12,24 +17,117 @@ import subprocess
 
 log = logging.getLogger(__name__)
 
+# responses larger than this are rejected instead of being read into memory
+MAX_CONTENT_SIZE = 50 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+NOT_MODIFIED = 304
 
-def _download_request(url, verify=True):
-    retry_strategy = Retry(
-        total=5,
+
+class HttpClient:
+    """Shared HTTP session with connection pooling and a retry policy
+
+    Connections are kept alive and re-used for all requests to the same host,
+    so a crawl of many pages on one site only pays the TCP/TLS handshake once.
+    """
+
+    def __init__(
+        self,
+        pool_connections=20,
+        pool_maxsize=10,
+        retries=5,
         backoff_factor=2,
-        status_forcelist=[403, 429, 500, 502, 503, 504],
-        allowed_methods=["HEAD", "GET", "OPTIONS"],
+        status_forcelist=(403, 429, 500, 502, 503, 504),
+        timeout=20,
+    ):
+        self.timeout = timeout
+        retry_strategy = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=list(status_forcelist),
+            allowed_methods=["HEAD", "GET", "OPTIONS"],
+        )
+        # pool_connections is the number of hosts with a pool,
+        # pool_maxsize the number of connections kept per host
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry_strategy,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers.update(
+            {
+                "user-agent": "Mozilla Firefox Mozilla/5.0; ebp-group website-keyword-monitor at github",  # noqa
+                "accept-language": "de-CH",
+            }
+        )
+
+    def get(self, url, verify=True, stream=False, headers=None):
+        return self.session.get(
+            url, headers=headers, timeout=self.timeout, verify=verify, stream=stream
+        )
+
+    def head(self, url, verify=True):
+        return self.session.head(
+            url, timeout=self.timeout, verify=verify, allow_redirects=True
+        )
+
+    def stats(self):
+        """Number of requests and opened connections per host"""
+        stats = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{key.key_scheme}://{key.key_host}:{key.key_port}"
+            opened = pool.num_connections
+            requests_sent = pool.num_requests
+            stats[host] = {
+                "requests": requests_sent,
+                "opened": opened,
+                "reused": max(0, requests_sent - opened),
+            }
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+client = HttpClient()
+# HEAD requests of the link filter are only a hint, they are not retried (a
+# failed probe lets the link through) and must not stall the crawl
+probe_client = HttpClient(pool_maxsize=4, retries=0, status_forcelist=(), timeout=5)
+
+
+def configure(**kwargs):
+    """Replace the shared client, e.g. to change the retry policy or pool sizes"""
+    global client
+    client.close()
+    client = HttpClient(**kwargs)
+    return client
+
+
+def log_pool_stats():
+    stats = client.stats()
+    total_requests = sum(s["requests"] for s in stats.values())
+    total_opened = sum(s["opened"] for s in stats.values())
+    log.info(
+        f"HTTP pool: {total_requests} requests, {total_opened} connections opened, "
+        f"{max(0, total_requests - total_opened)} re-used"
     )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    http = requests.Session()
-    http.mount("https://", adapter)
-    http.mount("http://", adapter)
-    headers = {
-        "user-agent": "Mozilla Firefox Mozilla/5.0; ebp-group website-keyword-monitor at github",  # noqa
-        "accept-language": "de-CH",
-    }
-    r = http.get(url, headers=headers, timeout=20, verify=verify)
-    r.raise_for_status()
+    for host, s in stats.items():
+        log.debug(f"HTTP pool {host}: {s}")
+
+
+def _download_request(url, verify=True, stream=False, headers=None):
+    r = client.get(url, verify=verify, stream=stream, headers=headers)
+    try:
+        r.raise_for_status()
+    except requests.exceptions.HTTPError:
+        r.close()
+        raise
     return r
 
 
@@ -57,8 +155,7 @@ def download_file(url, path, verify=True):
             f.write(chunk)
 
 
-def get_content_type(url, verify=True):
-    r = _download_request(url, verify=verify)
+def _content_type(r):
     content_type = r.headers.get("content-type")
     log.debug(f"Content-Type: {content_type}")
     if not content_type:
@@ -66,7 +163,87 @@ def get_content_type(url, verify=True):
     return content_type
 
 
-def download_with_selenium(url, timeout=3):
+def get_content_type(url, verify=True):
+    with contextlib.closing(_download_request(url, verify=verify, stream=True)) as r:
+        return _content_type(r)
+
+
+def head_content_type(url, verify=True):
+    """Content type of a URL according to a HEAD request, None if it's unknown"""
+    with contextlib.closing(probe_client.head(url, verify=verify)) as r:
+        if not r.ok:
+            return None
+        return _content_type(r) or None
+
+
+def supported_content_type(content_type):
+    """Only PDFs and text (e.g. HTML) can be matched"""
+    return "application/pdf" in content_type or "text" in content_type
+
+
+def validators(r):
+    """Headers of a response that can be used for a conditional request"""
+    return {
+        "etag": r.headers.get("etag"),
+        "last_modified": r.headers.get("last-modified"),
+    }
+
+
+@contextlib.contextmanager
+def fetch(url, verify=True, max_size=MAX_CONTENT_SIZE, headers=None):
+    """Send a single streamed request, only the headers are read at this point
+
+    Yields a tuple of the content type and the response, the body can then
+    either be read with `read_content` or it is discarded when the context
+    exits (e.g. if the page is rendered with Selenium instead).
+    For conditional requests (`headers` with If-None-Match/If-Modified-Since)
+    the status of the response is NOT_MODIFIED if the page did not change.
+    """
+    r = _download_request(url, verify=verify, stream=True, headers=headers)
+    with contextlib.closing(r):
+        content_type = _content_type(r)
+        if r.status_code == NOT_MODIFIED:
+            yield (content_type, r)
+            return
+        if not supported_content_type(content_type):
+            raise ValueError(
+                f"Unsupported content type: {content_type}, skipping URL {url}"
+            )
+        content_length = r.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > max_size:
+            raise ValueError(
+                f"Content too large ({content_length} bytes), skipping URL {url}"
+            )
+        yield (content_type, r)
+
+
+def read_content(r, max_size=MAX_CONTENT_SIZE):
+    """Read the body of a streamed response, abort if it exceeds max_size"""
+    chunks = []
+    size = 0
+    for chunk in r.iter_content(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            raise ValueError(f"Content larger than {max_size} bytes: {r.url}")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def write_content(r, f, max_size=MAX_CONTENT_SIZE):
+    """Write the body of a streamed response to a file, returns its SHA-256"""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in r.iter_content(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            raise ValueError(f"Content larger than {max_size} bytes: {r.url}")
+        digest.update(chunk)
+        f.write(chunk)
+    f.flush()
+    return digest.hexdigest()
+
+
+def _start_chrome():
     chrome_options = Options()
     chrome_options.add_argument("start-maximized")
     chrome_options.add_argument("--headless")
@@ -87,13 +264,224 @@ def download_with_selenium(url, timeout=3):
         renderer="Intel Iris OpenGL Engine",
         fix_hairline=True,
     )
+    return driver
+
+
+class BrowserPool:
+    """Long-lived Chrome instances that are re-used for all dynamic pages
+
+    At most `max_tabs` pages are rendered at the same time. A WebDriver session
+    must not be used by several threads at once, so every concurrent tab gets
+    its own browser. Browsers are recycled after `max_pages` pages, when they
+    no longer respond or when a WebDriver error occurs.
+    """
+
+    def __init__(self, max_tabs=2, max_pages=50):
+        self.max_tabs = max_tabs
+        self.max_pages = max_pages
+        self.started = 0
+        self._slots = threading.BoundedSemaphore(max_tabs)
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def _healthy(self, driver):
+        try:
+            driver.window_handles
+            return True
+        except WebDriverException:
+            return False
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except WebDriverException:
+            log.debug("Browser could not be stopped, it probably crashed.")
+
+    def _checkout(self):
+        with self._lock:
+            entry = self._idle.pop() if self._idle else None
+        if entry is not None and not self._healthy(entry[0]):
+            log.info("Browser does not respond anymore, start a new one.")
+            self._quit(entry[0])
+            entry = None
+        if entry is None:
+            log.debug("Start new browser")
+            entry = [_start_chrome(), 0]
+            with self._lock:
+                self.started += 1
+        return entry
+
+    @contextlib.contextmanager
+    def browser(self):
+        with self._slots:
+            entry = self._checkout()
+            try:
+                yield entry[0]
+            except BaseException:
+                # the state of the browser is unknown after an error
+                self._quit(entry[0])
+                raise
+            entry[1] += 1
+            if entry[1] >= self.max_pages:
+                log.debug(f"Browser rendered {entry[1]} pages, recycle it.")
+                self._quit(entry[0])
+            else:
+                with self._lock:
+                    self._idle.append(entry)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for driver, _ in idle:
+            self._quit(driver)
+        if self.started:
+            log.info(f"Browser pool: {self.started} browsers started")
+
+
+browser_pool = BrowserPool()
+atexit.register(lambda: browser_pool.close())
+
+
+def configure_browser_pool(**kwargs):
+    """Replace the shared browser pool, e.g. to change the number of tabs"""
+    global browser_pool
+    browser_pool.close()
+    browser_pool = BrowserPool(**kwargs)
+    return browser_pool
+
+
+READY_STRATEGIES = ("fixed", "stable", "selector", "network-idle")
+# signature of the DOM, it changes as long as content is added to the page
+DOM_SIGNATURE_JS = """
+return [
+    document.readyState,
+    document.getElementsByTagName("*").length,
+    document.body ? document.body.innerHTML.length : 0
+].join(":");
+"""
+NETWORK_SIGNATURE_JS = """
+return [
+    document.readyState,
+    performance.getEntriesByType("resource").length
+].join(":");
+"""
 
-    driver.get(url)
-    # wait for the page to load
-    time.sleep(timeout)
-    content = driver.page_source
+
+def _wait_until_stable(driver, script, timeout, stable_ms, poll=0.1):
+    """Wait until the result of the script is the same for stable_ms"""
+    deadline = time.monotonic() + timeout
+    last_value = None
+    stable_since = time.monotonic()
+    while time.monotonic() < deadline:
+        value = driver.execute_script(script)
+        now = time.monotonic()
+        if value != last_value:
+            last_value = value
+            stable_since = now
+        elif value.startswith("complete") and now - stable_since >= stable_ms / 1000:
+            return True
+        time.sleep(poll)
+    return False
+
+
+def _wait_for_selector(driver, selector, timeout, poll=0.1):
+    # use JS instead of find_element, as the implicit wait of the driver
+    # would block every single check for up to 20 seconds
+    script = "return document.querySelector(arguments[0]) !== null;"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if driver.execute_script(script, selector):
+            return True
+        time.sleep(poll)
+    return False
+
+
+def wait_until_ready(driver, timeout, ready="fixed", selector=None, stable_ms=500):
+    """Wait until a page is ready, but at most `timeout` seconds
+
+    Strategies:
+      fixed:        always wait `timeout` seconds
+      stable:       wait until the DOM did not change for `stable_ms`
+      selector:     wait until an element matching the CSS selector exists
+      network-idle: wait until no new resources were loaded for `stable_ms`
+    """
+    if ready == "fixed":
+        time.sleep(timeout)
+        return
+    if ready == "stable":
+        ready_in_time = _wait_until_stable(driver, DOM_SIGNATURE_JS, timeout, stable_ms)
+    elif ready == "selector":
+        if not selector:
+            raise ValueError("The readiness strategy 'selector' needs a selector")
+        ready_in_time = _wait_for_selector(driver, selector, timeout)
+    elif ready == "network-idle":
+        ready_in_time = _wait_until_stable(
+            driver, NETWORK_SIGNATURE_JS, timeout, stable_ms
+        )
+    else:
+        raise ValueError(f"Invalid readiness strategy: {ready}")
+
+    if not ready_in_time:
+        log.info(f"Page not ready ({ready}) after {timeout} seconds, continue anyway")
+
+
+# URL patterns of resources that are not needed to get the text of a page
+BLOCKED_RESOURCES = {
+    "images": [
+        "*.png",
+        "*.jpg",
+        "*.jpeg",
+        "*.gif",
+        "*.webp",
+        "*.avif",
+        "*.svg",
+        "*.ico",
+    ],
+    "fonts": ["*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot"],
+    "media": ["*.mp4", "*.webm", "*.ogg", "*.mp3", "*.wav", "*.m4a"],
+    "stylesheets": ["*.css"],
+    "trackers": [
+        "*google-analytics.com*",
+        "*googletagmanager.com*",
+        "*doubleclick.net*",
+        "*connect.facebook.net*",
+        "*hotjar.com*",
+        "*siteimproveanalytics.com*",
+        "*matomo.js*",
+        "*piwik.js*",
+        "*clarity.ms*",
+    ],
+}
+BLOCK_MODES = {
+    "all": ("images", "fonts", "media", "stylesheets", "trackers"),
+    # for sites that don't work without CSS
+    "media": ("images", "fonts", "media", "trackers"),
+    "none": (),
+}
+
+
+def blocked_urls(mode="all"):
+    if mode not in BLOCK_MODES:
+        raise ValueError(f"Invalid resource blocking mode: {mode}")
+    return [p for resource in BLOCK_MODES[mode] for p in BLOCKED_RESOURCES[resource]]
+
+
+def _block_resources(driver, mode):
+    # the browsers are re-used, so the blocked URLs are set for every page
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_urls(mode)})
+
+
+def download_with_selenium(
+    url, timeout=3, ready="fixed", selector=None, block_resources="all"
+):
+    with browser_pool.browser() as driver:
+        _block_resources(driver, block_resources)
+        driver.get(url)
+        # wait for the page to load
+        wait_until_ready(driver, timeout, ready=ready, selector=selector)
+        content = driver.page_source
     log.debug(f"Website source: {content}")
-    driver.quit()
 
     return content
 
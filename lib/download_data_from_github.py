@@ -1,30 +1,47 @@
 #!/usr/bin/env python
 # coding: utf-8
-"""Download latest artifact from GitHub Actions
+"""Download the latest artifacts from GitHub Actions
+
+The artifact list is paged through (filtered by name on the server if the
+name is not a pattern), the latest artifact of every matching name on the
+branch is downloaded to a temporary file and extracted from there. The
+artifacts are downloaded concurrently, but extracted one after the other,
+since they share directories. The digests of the extracted artifacts are
+saved in the output directory, an artifact with the same digest is not
+downloaded again.
 
 Usage:
-  download_data_from_github.py [-n <artifact-name>]
+  download_data_from_github.py [-n <artifact-name>] [--output <dir>] [--workers <num>] [--force]
   download_data_from_github.py (-h | --help)
   download_data_from_github.py --version
 
 Options:
   -h, --help                   Show this screen.
   --version                    Show version.
-  -n, --name <artifact-name>   Download artifact with this name [default: output].
-"""
+  -n, --name <artifact-name>   Download artifacts with this name, may be a pattern like output-* [default: output].
+  -o, --output <dir>           Directory into which the artifacts are extracted [default: .].
+  --workers <num>              Number of artifacts that are downloaded at the same time [default: 4].
+  --force                      Download the artifacts even if they are already extracted.
+"""  # noqa: E501
 
+import fnmatch
+import hashlib
+import json
 import os
-import io
 import sys
+import tempfile
 import zipfile
 import logging
 
+import requests
 from docopt import docopt
-from ghapi.all import GhApi
 from dotenv import load_dotenv, find_dotenv
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from scheduler import Scheduler
 
 load_dotenv(find_dotenv())
-arguments = docopt(__doc__, version="download_data_from_github.py 1.0")
+arguments = docopt(__doc__, version="download_data_from_github.py 2.0")
 name = arguments["--name"]
 
 log = logging.getLogger(__name__)
@@ -37,9 +54,116 @@ logging.basicConfig(
 )
 logging.captureWarnings(True)
 
+PER_PAGE = 100
+CHUNK_SIZE = 1024 * 1024
+# digests of the extracted artifacts, by artifact name
+MANIFEST = ".artifacts.json"
+
+
+def github_session(token):
+    retry_strategy = Retry(
+        total=5,
+        backoff_factor=2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=retry_strategy)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(
+        {
+            "Accept": "application/vnd.github+json",
+            "Authorization": f"Bearer {token}",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+    )
+    return session
+
+
+def list_artifacts(session, url, name):
+    """All artifacts of the repo, newest first, one page after the other"""
+    params = {"per_page": PER_PAGE}
+    if not any(c in name for c in "*?["):
+        params["name"] = name
+    while url:
+        r = session.get(url, params=params, timeout=30)
+        r.raise_for_status()
+        yield from r.json()["artifacts"]
+        # the next URL already contains all parameters
+        url = r.links.get("next", {}).get("url")
+        params = None
+
+
+def latest_artifacts(artifacts, name, branch):
+    """The latest artifact of every name that matches on the branch"""
+    latest = {}
+    for artifact in artifacts:
+        if artifact["name"] in latest or artifact.get("expired"):
+            continue
+        if not fnmatch.fnmatchcase(artifact["name"], name):
+            continue
+        if (artifact.get("workflow_run") or {}).get("head_branch") != branch:
+            continue
+        latest[artifact["name"]] = artifact
+        if name == artifact["name"]:
+            break
+    return list(latest.values())
+
+
+def artifact_digest(artifact):
+    return artifact.get("digest") or f"id:{artifact['id']}"
 
-def filter_artifacts(d):
-    return d["name"] == name and d["workflow_run"]["head_branch"] == branch
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def not_extracted(artifacts, manifest):
+    """Artifacts whose digest differs from the one of the extracted artifact"""
+    for artifact in artifacts:
+        if manifest.get(artifact["name"]) == artifact_digest(artifact):
+            log.info(f"Artifact {artifact['name']} is already extracted, skipping.")
+        else:
+            yield artifact
+
+
+def download_artifact(session, artifact):
+    """Stream the ZIP of an artifact to a temporary file, returns the open file"""
+    expected = artifact.get("digest", "")
+    sha256 = hashlib.sha256()
+    f = tempfile.TemporaryFile()
+    try:
+        with session.get(
+            artifact["archive_download_url"], stream=True, timeout=60
+        ) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                sha256.update(chunk)
+        if (
+            expected.startswith("sha256:")
+            and expected != f"sha256:{sha256.hexdigest()}"
+        ):
+            raise ValueError(f"Artifact {artifact['name']} has the wrong digest")
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+
+def extract_artifact(f, output_dir):
+    """Extract a downloaded ZIP and close the file, returns the size of the ZIP"""
+    with f:
+        size = f.tell()
+        f.seek(0)
+        with zipfile.ZipFile(f) as zip_ref:
+            zip_ref.extractall(output_dir)
+    return size
 
 
 try:
@@ -47,20 +171,56 @@ try:
     owner = os.getenv("GITHUB_REPO_OWNER", "ebp-group")
     repo = os.getenv("GITHUB_REPO", "website-keyword-monitor")
     branch = os.getenv("GITHUB_BRANCH", "main")
-    api = GhApi(owner=owner, repo=repo, token=github_token)
-    artifacts = api.actions.list_artifacts_for_repo()["artifacts"]
+    api_url = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+    output_dir = arguments["--output"]
 
-    latest_artificat = next(filter(filter_artifacts, artifacts), {})
-    if not latest_artificat:
+    session = github_session(github_token)
+    artifacts = latest_artifacts(
+        list_artifacts(
+            session, f"{api_url}/repos/{owner}/{repo}/actions/artifacts", name
+        ),
+        name,
+        branch,
+    )
+    if not artifacts:
         log.error(f"ERROR: could not find artifact with name '{name}'.")
         sys.exit(1)
 
-    download = api.actions.download_artifact(
-        artifact_id=latest_artificat["id"], archive_format="zip"
-    )
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    manifest = load_manifest(manifest_path)
+    if not arguments["--force"]:
+        artifacts = list(not_extracted(artifacts, manifest))
+
+    scheduler = Scheduler(workers=int(arguments["--workers"]))
+    failed = []
+    try:
+        for artifact, future in scheduler.map_ordered(
+            lambda a: download_artifact(session, a), artifacts
+        ):
+            # the artifacts share directories, so only one is extracted at a time
+            try:
+                size = extract_artifact(future.result(), output_dir)
+            except (
+                requests.RequestException,
+                zipfile.BadZipFile,
+                OSError,
+                ValueError,
+            ):
+                log.exception(
+                    f"Error when downloading or extracting {artifact['name']}"
+                )
+                failed.append(artifact["name"])
+                continue
+            log.info(f"Extracted artifact {artifact['name']} ({size} bytes)")
+            manifest[artifact["name"]] = artifact_digest(artifact)
+    finally:
+        scheduler.shutdown()
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
 
-    with zipfile.ZipFile(io.BytesIO(download)) as zip_ref:
-        zip_ref.extractall(".")
+    if failed:
+        raise Exception(f"Download failed for: {', '.join(failed)}")
 
 except Exception:
     log.exception("Error in download_data_from_github.py")
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Cache of fetched and parsed pages, shared by the crawls of the same URL
+
+If the same URL is monitored by several groups, it's downloaded only once per
+run and parsed only once, all crawlers of the URL then match their own keywords
+against the shared page. The crawlers of a URL run one after the other, every
+entry is dropped as soon as the last of them has used it, so at the end of the
+crawls of a URL no page is kept.
+"""
+
+import collections
+import logging
+import threading
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+MAX_ENTRIES = 1000
+
+
+class FetchCache:
+    """Fetch results and parsed pages of `users` crawlers
+
+    An entry is dropped once all users have used it, at most `max_entries` are
+    kept (the least recently used ones are evicted).
+    """
+
+    def __init__(self, users=2, max_entries=MAX_ENTRIES):
+        self.users = users
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.parse_hits = 0
+        self._lock = threading.Lock()
+        # key -> [request headers, future of the fetch result, uses]
+        self._fetches = collections.OrderedDict()
+        # key -> [parsed page, uses]
+        self._pages = collections.OrderedDict()
+
+    def _reusable(self, entry, headers):
+        entry_headers, future, _ = entry
+        if entry_headers == headers:
+            return True
+        if not future.done():
+            return False
+        # a complete page (or an error) is valid for any request headers, but a
+        # "not modified" response only for the same conditional request
+        return future.exception() is not None or not future.result().not_modified
+
+    def _use(self, entries, key):
+        """Count a use of an entry, drop it if all users have used it"""
+        entry = entries[key]
+        entry[-1] += 1
+        if entry[-1] >= self.users:
+            del entries[key]
+        else:
+            entries.move_to_end(key)
+
+    def fetch(self, key, headers, func):
+        """Return the result of func(headers), fetched at most once per key"""
+        headers = headers or {}
+        with self._lock:
+            entry = self._fetches.get(key)
+            owner = entry is None or not self._reusable(entry, headers)
+            if owner:
+                self.misses += 1
+                entry = [headers, Future(), 0]
+                self._fetches[key] = entry
+                self._evict(self._fetches)
+            else:
+                self.hits += 1
+                log.debug(f"Re-use fetched page {key[0]}")
+            self._use(self._fetches, key)
+        future = entry[1]
+
+        if owner:
+            try:
+                future.set_result(func(headers))
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def parse(self, key, func):
+        """Return the result of func(), parsed at most once per key"""
+        with self._lock:
+            if key in self._pages:
+                self.parse_hits += 1
+                page = self._pages[key][0]
+                self._use(self._pages, key)
+                return page
+        page = func()
+        with self._lock:
+            self._pages[key] = [page, 0]
+            self._use(self._pages, key)
+            self._evict(self._pages)
+        return page
+
+    def _evict(self, entries):
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def log_stats(self):
+        log.info(
+            f"Fetch cache: {self.hits} hits, {self.misses} fetches, "
+            f"{self.parse_hits} re-used parsed pages"
+        )
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""Local web server with synthetic websites for the benchmark
+
+Every section of the site is a start page with links to many sub-pages,
+modelled on the websites that are monitored:
+
+  /listing/:    a news listing with hundreds of articles
+  /pdf/:        a list of PDF documents with several pages each
+  /slow/:       articles that are only sent after a delay
+  /throttled/:  articles that first respond with 429 or 503 and Retry-After
+  /redirects/:  links that redirect (also in chains) to a smaller set of pages
+
+All pages are generated deterministically and have an ETag, so a second crawl
+with the page cache gets 304 responses for unchanged pages.
+"""
+
+import contextlib
+import hashlib
+import http.server
+import logging
+import re
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+LISTING_PAGES = 300
+PDF_DOCUMENTS = 20
+PDF_PAGES = 3
+SLOW_PAGES = 40
+SLOW_SECONDS = 0.25
+THROTTLED_PAGES = 20
+RETRY_AFTER = 1
+REDIRECT_LINKS = 100
+REDIRECT_TARGETS = 50
+PARAGRAPHS = 20
+
+WORDS = (
+    "Gemeinde Gemeinderat Bauprojekt Strasse Quartier Schule Verwaltung "
+    "Bevölkerung Sitzung Bericht Kredit Planung Umgebung Anlass Verkehr "
+    "Versammlung Abstimmung Budget Rechnung Wasser Energie Wald Sport"
+).split()
+# one of these is in some of the paragraphs, so the pages have matches
+KEYWORDS = ("Richtplan", "Zonenplan", "Baugesuch", "Planauflage", "Mitwirkung")
+
+
+def paragraph(page, n):
+    """A paragraph of text that only depends on the page and its number"""
+    seed = int(hashlib.sha256(f"{page}/{n}".encode()).hexdigest()[:8], 16)
+    words = [WORDS[(seed >> i) % len(WORDS)] for i in range(40)]
+    if seed % 7 == 0:
+        words.insert(seed % 40, KEYWORDS[seed % len(KEYWORDS)])
+    return " ".join(words) + "."
+
+
+def html_page(title, body):
+    return (
+        "<!DOCTYPE html>\n<html><head><meta charset='utf-8'>"
+        f"<title>{title}</title></head>\n<body><nav><a href='/'>Startseite</a> "
+        "<a href='#main'>Inhalt</a></nav>\n<main id='main'><h1>"
+        f"{title}</h1>\n{body}\n</main></body></html>\n"
+    ).encode("utf-8")
+
+
+def article(path):
+    texts = "\n".join(f"<p>{paragraph(path, n)}</p>" for n in range(PARAGRAPHS))
+    return html_page(f"Artikel {path}", texts)
+
+
+def link_list(title, hrefs):
+    items = "\n".join(
+        f"<li><a href='{href}'>Meldung {i}: {paragraph(href, 0)[:60]}</a></li>"
+        for i, href in enumerate(hrefs)
+    )
+    return html_page(title, f"<ul>\n{items}\n</ul>")
+
+
+def pdf_document(name, pages=PDF_PAGES):
+    """A minimal PDF with a few lines of text on every page"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None]
+    font = 3 + 2 * pages
+    kids = []
+    for page in range(pages):
+        lines = [paragraph(f"{name}/{page}", n)[:80] for n in range(10)]
+        text = " T* ".join(f"({line})'" for line in lines)
+        stream = f"BT /F1 10 Tf 14 TL 50 780 Td {text} ET".encode("latin-1", "replace")
+        kids.append(f"{len(objects) + 1} 0 R")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Contents {len(objects) + 2} 0 R "
+            f"/Resources << /Font << /F1 {font} 0 R >> >> >>".encode()
+        )
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (i, obj)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\n" % (len(objects) + 1)
+    pdf += b"startxref\n%d\n%%%%EOF\n" % xref
+    return pdf
+
+
+class FixtureSite:
+    """Responses of all paths of the synthetic site"""
+
+    def __init__(self):
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    def count(self, path):
+        """Count the requests of a path, returns the number including this one"""
+        with self._lock:
+            self._requests[path] = self._requests.get(path, 0) + 1
+            return self._requests[path]
+
+    def response(self, path):
+        """(status, headers, body) of a path"""
+        routes = (
+            (r"/", self.home),
+            (r"/listing/", self.listing),
+            (r"/listing/a(\d+)\.html", self.article),
+            (r"/pdf/", self.pdf_list),
+            (r"/pdf/d(\d+)\.pdf", self.pdf),
+            (r"/slow/", self.slow_list),
+            (r"/slow/s(\d+)\.html", self.slow),
+            (r"/throttled/", self.throttled_list),
+            (r"/throttled/t(\d+)\.html", self.throttled),
+            (r"/redirects/", self.redirect_list),
+            (r"/redirects/r(\d+)", self.redirect),
+            (r"/redirects/t(\d+)\.html", self.article),
+        )
+        for pattern, handler in routes:
+            m = re.fullmatch(pattern, path)
+            if m:
+                return handler(path, *m.groups())
+        return 404, {}, b"Not found"
+
+    def html(self, body):
+        return 200, {"Content-Type": "text/html; charset=utf-8"}, body
+
+    def home(self, path):
+        hrefs = ["/listing/", "/pdf/", "/slow/", "/throttled/", "/redirects/"]
+        return self.html(link_list("Startseite", hrefs))
+
+    def listing(self, path):
+        hrefs = [f"/listing/a{i}.html" for i in range(LISTING_PAGES)]
+        return self.html(link_list("Aktuelles", hrefs))
+
+    def article(self, path, number):
+        return self.html(article(path))
+
+    def pdf_list(self, path):
+        hrefs = [f"/pdf/d{i}.pdf" for i in range(PDF_DOCUMENTS)]
+        return self.html(link_list("Publikationen", hrefs))
+
+    def pdf(self, path, number):
+        return 200, {"Content-Type": "application/pdf"}, pdf_document(path)
+
+    def slow_list(self, path):
+        hrefs = [f"/slow/s{i}.html" for i in range(SLOW_PAGES)]
+        return self.html(link_list("Langsame Seiten", hrefs))
+
+    def slow(self, path, number):
+        time.sleep(SLOW_SECONDS)
+        return self.article(path, number)
+
+    def throttled_list(self, path):
+        hrefs = [f"/throttled/t{i}.html" for i in range(THROTTLED_PAGES)]
+        return self.html(link_list("Begrenzte Seiten", hrefs))
+
+    def throttled(self, path, number):
+        # the first request of every page is rejected
+        if self.count(path) == 1:
+            status = 429 if int(number) % 2 == 0 else 503
+            return status, {"Retry-After": str(RETRY_AFTER)}, b"Try again later"
+        return self.article(path, number)
+
+    def redirect_list(self, path):
+        hrefs = [f"/redirects/r{i}" for i in range(REDIRECT_LINKS)]
+        return self.html(link_list("Weiterleitungen", hrefs))
+
+    def redirect(self, path, number):
+        number = int(number)
+        if number >= REDIRECT_TARGETS:
+            # a chain of two redirects, ending at the same page as r<n - 50>
+            location = f"/redirects/r{number - REDIRECT_TARGETS}"
+        else:
+            location = f"/redirects/t{number}.html"
+        return 301, {"Location": location}, b""
+
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+    # keep-alive, like the web servers of the monitored websites
+    protocol_version = "HTTP/1.1"
+    site = None
+
+    def send(self, head_only=False):
+        status, headers, body = self.site.response(self.path.split("?")[0])
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status in (200, 304):
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.send()
+
+    def do_HEAD(self):
+        self.send(head_only=True)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+@contextlib.contextmanager
+def serve(port=0):
+    """Run the fixture server in a thread, yields its base URL"""
+    handler = type("Handler", (FixtureHandler,), {"site": FixtureSite()})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Store for the hashes of already known texts
+
+The hash files in `hashes/` contain one SHA-256 hex digest per line, sorted
+and without a trailing newline.
+
+Optionally the hashes can be stored in a compact binary format (`*.bin`):
+a 16 byte header, the sorted binary digests (full 32 bytes or truncated to
+16 bytes) and an append-only delta segment with the unsorted digests that
+were added by later runs. New hashes are appended to the delta segment, only
+if it grows too large, the file is compacted to one sorted segment again.
+"""
+
+import heapq
+import logging
+import mmap
+import os
+import shutil
+import struct
+
+log = logging.getLogger(__name__)
+
+BINARY_SUFFIX = ".bin"
+# magic, version, digest size, reserved, number of digests in the sorted segment
+HEADER = struct.Struct("<4sBBHQ")
+MAGIC = b"WKMH"
+VERSION = 1
+DIGEST_SIZES = (32, 16)
+# the delta segment is compacted if it has more digests than this (or 1/8 of
+# the sorted segment, if that's more)
+COMPACT_MIN_DELTA = 1024
+
+
+class HashStore:
+    """In-memory set of known text hashes with load/persist helpers"""
+
+    def __init__(self, hashes=None):
+        self._hashes = set(hashes or [])
+        self._added = set()
+
+    @classmethod
+    def load(cls, path):
+        store = cls()
+        try:
+            with open(path) as f:
+                store._hashes.update(line.strip() for line in f if line.strip())
+        except IOError:
+            log.info(f"Hash-File at {path} does not exist.")
+        return store
+
+    def __contains__(self, text_hash):
+        return text_hash in self._hashes
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __iter__(self):
+        return iter(self._hashes)
+
+    @property
+    def added(self):
+        """Hashes that were added since the store was loaded"""
+        return sorted(self._added)
+
+    def add(self, text_hash):
+        if text_hash not in self._hashes:
+            self._hashes.add(text_hash)
+            self._added.add(text_hash)
+
+    def update(self, hashes):
+        for text_hash in hashes:
+            self.add(text_hash)
+
+    def persist(self, path):
+        hashes_str = "\n".join(sorted(self._hashes))
+        with open(path, "w") as f:
+            f.write(hashes_str)
+
+
+class CompactHashStore:
+    """Known text hashes in the compact binary format
+
+    The sorted segment is memory-mapped and binary-searched, only the delta
+    segment is loaded into memory. Hashes are passed in and out as hex digests
+    like with HashStore, truncated digests are compared by their prefix.
+    """
+
+    def __init__(self, digest_size=32):
+        if digest_size not in DIGEST_SIZES:
+            raise ValueError(f"Invalid digest size: {digest_size}")
+        self.digest_size = digest_size
+        self.path = None
+        self._mm = None
+        self._base_count = 0
+        self._delta = set()
+        self._pending = set()
+        self._added = set()
+
+    @classmethod
+    def load(cls, path, digest_size=32):
+        try:
+            f = open(path, "rb")
+        except IOError:
+            log.info(f"Hash-File at {path} does not exist.")
+            return cls(digest_size)
+
+        with f:
+            magic, version, size, _, base_count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"Hash-File at {path} is not a compact hash file.")
+            store = cls(size)
+            store.path = path
+            store._base_count = base_count
+            base_end = HEADER.size + base_count * size
+            f.seek(base_end)
+            delta = f.read()
+            store._delta = {
+                delta[i : i + size] for i in range(0, len(delta) - size + 1, size)
+            }
+            if base_count:
+                store._mm = mmap.mmap(f.fileno(), base_end, access=mmap.ACCESS_READ)
+        return store
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _key(self, text_hash):
+        return bytes.fromhex(text_hash)[: self.digest_size]
+
+    def _record(self, index):
+        start = HEADER.size + index * self.digest_size
+        return self._mm[start : start + self.digest_size]
+
+    def _in_base(self, key):
+        lo, hi = 0, self._base_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = self._record(mid)
+            if record == key:
+                return True
+            if record < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return False
+
+    def _contains_key(self, key):
+        return key in self._pending or key in self._delta or self._in_base(key)
+
+    def __contains__(self, text_hash):
+        return self._contains_key(self._key(text_hash))
+
+    def __len__(self):
+        return self._base_count + len(self._delta) + len(self._pending)
+
+    def _base_keys(self):
+        for index in range(self._base_count):
+            yield self._record(index)
+
+    def _keys(self):
+        return heapq.merge(self._base_keys(), sorted(self._delta | self._pending))
+
+    def __iter__(self):
+        return (key.hex() for key in self._keys())
+
+    @property
+    def added(self):
+        """Hashes that were added since the store was loaded"""
+        return sorted(self._added)
+
+    def add(self, text_hash):
+        key = self._key(text_hash)
+        if not self._contains_key(key):
+            self._pending.add(key)
+            self._added.add(text_hash)
+
+    def update(self, hashes):
+        for text_hash in hashes:
+            self.add(text_hash)
+
+    def needs_compaction(self):
+        delta_count = len(self._delta) + len(self._pending)
+        return delta_count > max(COMPACT_MIN_DELTA, self._base_count // 8)
+
+    def persist(self, path, compact=False):
+        """Write the store to path, new hashes are appended to the delta segment"""
+        if compact or self.path is None or self.needs_compaction():
+            self._compact(path)
+            return
+
+        if os.path.abspath(path) != os.path.abspath(self.path):
+            shutil.copyfile(self.path, path)
+        with open(path, "ab") as f:
+            f.write(b"".join(sorted(self._pending)))
+        self._delta |= self._pending
+        self._pending = set()
+        self.path = path
+
+    def _compact(self, path):
+        log.info(f"Compact hash file {path}")
+        keys = list(self._keys())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.digest_size, 0, len(keys)))
+            f.write(b"".join(keys))
+        self.close()
+        os.replace(tmp_path, path)
+        self.path = path
+        self._base_count = len(keys)
+        self._delta = set()
+        self._pending = set()
+        if keys:
+            with open(path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def load_hash_store(path):
+    """Load the hash store in the format given by the file extension"""
+    if path and path.endswith(BINARY_SUFFIX):
+        return CompactHashStore.load(path)
+    return HashStore.load(path)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Convert hash files between the text and the compact binary format
+
+Usage:
+  hash_tool.py import <txt-path> <bin-path> [--digest-size <bytes>] [--verbose]
+  hash_tool.py export <bin-path> <txt-path> [--verbose]
+  hash_tool.py compact <bin-path> [--verbose]
+  hash_tool.py (-h | --help)
+  hash_tool.py --version
+
+Options:
+  -h, --help                    Show this screen.
+  --version                     Show version.
+  --digest-size <bytes>         Size of the stored digests, 32 (full) or 16 (truncated) [default: 32].
+  --verbose                     Option to enable more verbose output.
+"""  # noqa: E501
+
+import logging
+import os
+import sys
+from docopt import docopt
+from hash_store import CompactHashStore, HashStore
+
+log = logging.getLogger(__name__)
+
+
+def import_hashes(txt_path, bin_path, digest_size):
+    store = CompactHashStore(digest_size)
+    store.update(HashStore.load(txt_path))
+    store.persist(bin_path, compact=True)
+    return store
+
+
+def export_hashes(bin_path, txt_path):
+    store = CompactHashStore.load(bin_path)
+    if store.digest_size != 32:
+        raise ValueError(
+            f"Hash-File at {bin_path} has truncated digests, which can't be "
+            "exported to the text format."
+        )
+    HashStore(store).persist(txt_path)
+    return store
+
+
+def compact_hashes(bin_path):
+    store = CompactHashStore.load(bin_path)
+    store.persist(bin_path, compact=True)
+    return store
+
+
+try:
+    arguments = docopt(__doc__, version="Convert hash files 1.0")
+
+    loglevel = logging.INFO
+    if arguments["--verbose"]:
+        loglevel = logging.DEBUG
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)-8s %(message)s",
+        level=loglevel,
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    logging.captureWarnings(True)
+
+    if arguments["import"]:
+        txt_path, bin_path = arguments["<txt-path>"], arguments["<bin-path>"]
+        store = import_hashes(txt_path, bin_path, int(arguments["--digest-size"]))
+    elif arguments["export"]:
+        txt_path, bin_path = arguments["<txt-path>"], arguments["<bin-path>"]
+        store = export_hashes(bin_path, txt_path)
+    else:
+        txt_path, bin_path = None, arguments["<bin-path>"]
+        store = compact_hashes(bin_path)
+
+    sizes = [
+        f"{path}: {os.path.getsize(path)} bytes"
+        for path in (txt_path, bin_path)
+        if path
+    ]
+    log.info(f"{len(store)} hashes ({', '.join(sizes)})")
+
+except Exception:
+    log.exception("Error in hash_tool.py")
+    sys.exit(1)
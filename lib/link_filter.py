@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""Filter for the links of a crawl, applied before any link is fetched
+
+A link is followed if it is in the scope of the start page (`any` host, the
+same `host` or the same `host` and path `prefix`) or matches one of the
+include patterns, and if it matches none of the exclude patterns. Links to
+social media and to files that can't be matched (images, archives, office
+documents, ...) are always skipped. For other unknown file extensions, an
+optional HEAD request checks the content type before the page is fetched.
+"""
+
+import collections
+import logging
+import posixpath
+import re
+import threading
+import urllib.parse
+from requests.exceptions import RequestException
+import download as dl
+
+log = logging.getLogger(__name__)
+
+SCOPES = ("any", "host", "prefix")
+# extensions of files that are not HTML, text or PDF
+BINARY_EXTENSIONS = {
+    # images
+    "avif",
+    "bmp",
+    "gif",
+    "heic",
+    "ico",
+    "jpeg",
+    "jpg",
+    "png",
+    "svg",
+    "tif",
+    "tiff",
+    "webp",
+    # audio and video
+    "avi",
+    "flac",
+    "m4a",
+    "m4v",
+    "mkv",
+    "mov",
+    "mp3",
+    "mp4",
+    "ogg",
+    "wav",
+    "webm",
+    "wmv",
+    # archives and executables
+    "7z",
+    "apk",
+    "bz2",
+    "dmg",
+    "exe",
+    "gz",
+    "iso",
+    "msi",
+    "rar",
+    "tar",
+    "tgz",
+    "xz",
+    "zip",
+    # office documents
+    "doc",
+    "docx",
+    "odp",
+    "ods",
+    "odt",
+    "ppt",
+    "pptx",
+    "rtf",
+    "xls",
+    "xlsx",
+    # fonts, styles and scripts
+    "css",
+    "eot",
+    "js",
+    "otf",
+    "ttf",
+    "woff",
+    "woff2",
+}
+# extensions of pages that are fetched without a HEAD request
+PAGE_EXTENSIONS = {
+    "",
+    "asp",
+    "aspx",
+    "cfm",
+    "htm",
+    "html",
+    "jsp",
+    "pdf",
+    "php",
+    "shtml",
+    "txt",
+    "xhtml",
+}
+SOCIAL_MEDIA_HOSTS = (
+    "facebook.com",
+    "flickr.com",
+    "instagram.com",
+    "linkedin.com",
+    "pinterest.com",
+    "t.me",
+    "threads.net",
+    "tiktok.com",
+    "twitter.com",
+    "vimeo.com",
+    "wa.me",
+    "whatsapp.com",
+    "x.com",
+    "xing.com",
+    "youtu.be",
+    "youtube.com",
+)
+
+
+def _host(parts):
+    host = (parts.hostname or "").lower()
+    return host[len("www.") :] if host.startswith("www.") else host
+
+
+def _extension(path):
+    name = posixpath.basename(path)
+    return name.rpartition(".")[2].lower() if "." in name else ""
+
+
+def _prefix(path):
+    """Path prefix of the scope, the directory of a file or the path itself"""
+    if _extension(path):
+        path = posixpath.dirname(path)
+    return path.rstrip("/") + "/"
+
+
+def _is_social_media(host):
+    return any(host == h or host.endswith(f".{h}") for h in SOCIAL_MEDIA_HOSTS)
+
+
+def link_filter_options(scope=None, include=None, exclude=None, probe=False):
+    """Options of a link filter, empty values are replaced by the defaults"""
+    scope = scope or "any"
+    if scope not in SCOPES:
+        raise ValueError(f"Invalid link scope: {scope}")
+    patterns = {}
+    for name, values in (("include", include), ("exclude", exclude)):
+        if isinstance(values, str):
+            values = [values]
+        try:
+            patterns[name] = [re.compile(v) for v in values or [] if v]
+        except re.error as e:
+            raise ValueError(f"Invalid {name} pattern: {e}")
+    return {"scope": scope, **patterns, "probe": probe in (True, "yes")}
+
+
+class LinkFilter:
+    """Decide which links of a crawl are fetched and count the skipped ones"""
+
+    def __init__(self, scope="any", include=(), exclude=(), probe=False, verify=True):
+        self.scope = scope
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.probe = probe
+        self.verify = verify
+        self.skipped = collections.Counter()
+        self._lock = threading.Lock()
+        self._host = None
+        self._prefix = None
+
+    def start(self, url):
+        """Set the start page of the crawl, the scope is relative to it"""
+        parts = urllib.parse.urlsplit(url)
+        self._host = _host(parts)
+        self._prefix = _prefix(parts.path)
+
+    def _in_scope(self, parts):
+        if self.scope == "any" or self._host is None:
+            return True
+        if _host(parts) != self._host:
+            return False
+        if self.scope == "prefix":
+            path = parts.path.rstrip("/") + "/"
+            return path.startswith(self._prefix)
+        return True
+
+    def _reason(self, url):
+        """Why a link is skipped, None if it's followed"""
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            return "scheme"
+        if _is_social_media(_host(parts)):
+            return "social media"
+        if _extension(parts.path) in BINARY_EXTENSIONS:
+            return "binary"
+        if any(p.search(url) for p in self.exclude):
+            return "exclude"
+        if not self._in_scope(parts) and not any(p.search(url) for p in self.include):
+            return "scope"
+        return None
+
+    def _skip(self, url, reason):
+        log.debug(f"Skip link {url} ({reason})")
+        with self._lock:
+            self.skipped[reason] += 1
+
+    def allowed(self, url):
+        reason = self._reason(url)
+        if reason is not None:
+            self._skip(url, reason)
+        return reason is None
+
+    def needs_probe(self, url):
+        path = urllib.parse.urlsplit(url).path
+        return self.probe and _extension(path) not in PAGE_EXTENSIONS
+
+    def probe_allowed(self, url):
+        """Check the content type of a link with a HEAD request"""
+        try:
+            content_type = dl.head_content_type(url, verify=self.verify)
+        except RequestException:
+            log.debug(f"HEAD request for {url} failed, fetch it anyway")
+            return True
+        if content_type is None or dl.supported_content_type(content_type):
+            return True
+        log.debug(f"Link {url} has the content type {content_type}")
+        self._skip(url, "probe")
+        return False
+
+    def log_stats(self):
+        total = sum(self.skipped.values())
+        details = ", ".join(f"{n} {reason}" for reason, n in self.skipped.items())
+        log.info(
+            f"Link filter: {total} links skipped" + (f" ({details})" if total else "")
+        )
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Timings of the stages of a crawl per URL and counters of a run
+
+The metrics of a website are written as JSON Lines (`metrics/<slug>.jsonl`):
+one record per fetched URL with the seconds spent in every stage, the number
+of bytes, the HTTP status and the retries, followed by one record of the
+whole run with the totals, the counters (cache hits, status codes, ...) and
+the peak memory usage of the process.
+`metrics_report.py` summarizes the files of several websites.
+
+Stages:
+  sleep:       waiting for the per-host limit (concurrency and delay)
+  connect:     DNS, connection and waiting for the response headers
+  download:    reading the response body
+  render:      loading a dynamic page with Selenium
+  convert:     extracting the text of a PDF
+  parse:       parsing the HTML
+  match:       matching the texts against the keywords (incl. hash_lookup)
+  hash_lookup: checking if the hashes of the matched texts are already known
+"""
+
+import collections
+import contextlib
+import json
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+STAGES = (
+    "sleep",
+    "connect",
+    "download",
+    "render",
+    "convert",
+    "parse",
+    "match",
+    "hash_lookup",
+)
+
+
+def peak_rss_mb():
+    """Peak resident set size of the process in MB, None if it's unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+
+class TimedLookups:
+    """Wrap a set of hashes and measure the time of the `in` checks"""
+
+    def __init__(self, hashes):
+        self.hashes = hashes
+        self.seconds = 0.0
+
+    def __contains__(self, text_hash):
+        start = time.perf_counter()
+        try:
+            return text_hash in self.hashes
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+class Metrics:
+    """Collect the metrics of the URLs of a crawl, safe to use from threads"""
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self._pages = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+
+    def _page(self, url):
+        page = self._pages.get(url)
+        if page is None:
+            page = {"url": url, "stages": {}}
+            self._pages[url] = page
+        return page
+
+    def add(self, url, stage, seconds):
+        """Add the seconds of a stage of a URL"""
+        with self._lock:
+            stages = self._page(url)["stages"]
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def timed(self, url, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(url, stage, time.perf_counter() - start)
+
+    def set(self, url, **values):
+        """Set values of a URL, e.g. its status or size"""
+        with self._lock:
+            self._page(url).update(values)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def summary(self):
+        """Totals of all URLs of the run"""
+        with self._lock:
+            pages = list(self._pages.values())
+            counters = dict(self.counters)
+        stages = collections.Counter()
+        for page in pages:
+            stages.update(page["stages"])
+        return {
+            "seconds": round(time.monotonic() - self._start, 3),
+            "pages": len(pages),
+            "bytes": sum(page.get("bytes", 0) for page in pages),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": {stage: round(stages[stage], 3) for stage in STAGES},
+            "counters": counters,
+        }
+
+    def write(self, path, **run):
+        """Write the records of the URLs and the summary of the run"""
+        summary = {"type": "run", **run, **self.summary()}
+        with self._lock:
+            pages = list(self._pages.values())
+        with open(path, "w") as f:
+            for page in pages:
+                stages = {k: round(v, 4) for k, v in page["stages"].items()}
+                record = {"type": "page", **page, "stages": stages}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.write(json.dumps(summary, ensure_ascii=False) + "\n")
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Summarize the metrics files of several websites as Markdown
+
+Shows the total time per stage, the slowest websites and pages and the
+counters of all runs. With --baseline, websites that got slower compared to
+the summary of an earlier run (saved with --json) are listed as well.
+
+Usage:
+  metrics_report.py <path>... [--top <num>] [--json <path>] [--baseline <path>] [--threshold <factor>] [--verbose]
+  metrics_report.py (-h | --help)
+  metrics_report.py --version
+
+Options:
+  -h, --help                    Show this screen.
+  --version                     Show version.
+  <path>                        Metrics files (*.jsonl) or directories with metrics files.
+  --top <num>                   Number of the slowest websites and pages that are shown [default: 10].
+  --json <path>                 Save the summary of all websites to a JSON file.
+  --baseline <path>             Compare with the JSON summary of an earlier run.
+  --threshold <factor>          Websites that take this many times longer than in the baseline are regressions [default: 1.5].
+  --verbose                     Option to enable more verbose output.
+"""  # noqa: E501
+
+import collections
+import glob
+import json
+import logging
+import os
+import sys
+from docopt import docopt
+from metrics import STAGES
+
+log = logging.getLogger(__name__)
+
+# websites that take less time than this are never reported as regressions
+MIN_REGRESSION_SECONDS = 10
+
+
+def metrics_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            pattern = os.path.join(path, "**", "*.jsonl")
+            yield from sorted(glob.glob(pattern, recursive=True))
+        else:
+            yield path
+
+
+def load_metrics(path):
+    """The page records and the run record of a metrics file"""
+    pages = []
+    run = None
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("type") == "run":
+                run = record
+            else:
+                pages.append(record)
+    return pages, run
+
+
+def page_seconds(page):
+    return sum(page["stages"].values())
+
+
+def summarize(paths):
+    websites = {}
+    pages = []
+    for path in metrics_paths(paths):
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            website_pages, run = load_metrics(path)
+        except (IOError, ValueError):
+            log.exception(f"Metrics at {path} can't be read, skipping...")
+            continue
+        if run is None:
+            log.warning(f"Metrics at {path} have no run record, skipping...")
+            continue
+        websites[name] = run
+        pages.extend((name, page) for page in website_pages)
+
+    stages = collections.Counter()
+    counters = collections.Counter()
+    for run in websites.values():
+        stages.update(run["stages"])
+        counters.update(run["counters"])
+    totals = {
+        "websites": len(websites),
+        "seconds": round(sum(r["seconds"] for r in websites.values()), 3),
+        "pages": sum(r["pages"] for r in websites.values()),
+        "bytes": sum(r["bytes"] for r in websites.values()),
+        "peak_rss_mb": max(
+            (r.get("peak_rss_mb") or 0 for r in websites.values()), default=0
+        ),
+        "stages": {stage: round(stages[stage], 3) for stage in STAGES},
+        "counters": dict(counters),
+    }
+    return {"totals": totals, "websites": websites}, pages
+
+
+def slowest_stage(run):
+    stage, seconds = max(run["stages"].items(), key=lambda s: s[1])
+    return f"{stage} ({seconds:.1f}s)"
+
+
+def regressions(websites, baseline, threshold):
+    for name, run in websites.items():
+        before = baseline["websites"].get(name)
+        if before is None or run["seconds"] < MIN_REGRESSION_SECONDS:
+            continue
+        if run["seconds"] > threshold * before["seconds"]:
+            yield name, before["seconds"], run["seconds"]
+
+
+def report(summary, pages, top=10, baseline=None, threshold=1.5):
+    totals = summary["totals"]
+    websites = summary["websites"]
+    lines = [
+        "## Metrics",
+        "",
+        f"{totals['websites']} websites, {totals['pages']} pages, "
+        f"{totals['bytes'] / 1024 / 1024:.1f} MB, {totals['seconds']:.0f} seconds, "
+        f"peak memory {totals['peak_rss_mb']:.0f} MB",
+        "",
+        "| Stage | Seconds |",
+        "|---|---:|",
+    ]
+    lines += [f"| {stage} | {s:.1f} |" for stage, s in totals["stages"].items()]
+
+    lines += [
+        "",
+        "### Slowest websites",
+        "",
+        "| Website | Seconds | Pages | MB | Peak RSS MB | Slowest stage | Complete |",
+        "|---|---:|---:|---:|---:|---|---|",
+    ]
+    slowest = sorted(websites.items(), key=lambda w: w[1]["seconds"], reverse=True)
+    for name, run in slowest[:top]:
+        lines.append(
+            f"| {name} | {run['seconds']:.1f} | {run['pages']} | "
+            f"{run['bytes'] / 1024 / 1024:.1f} | {run.get('peak_rss_mb') or ''} | "
+            f"{slowest_stage(run)} | "
+            f"{'yes' if run.get('complete', True) else 'no'} |"
+        )
+
+    lines += [
+        "",
+        "### Slowest pages",
+        "",
+        "| Website | URL | Seconds | Status |",
+        "|---|---|---:|---|",
+    ]
+    pages = sorted(pages, key=lambda p: page_seconds(p[1]), reverse=True)
+    for name, page in pages[:top]:
+        lines.append(
+            f"| {name} | {page['url']} | {page_seconds(page):.1f} | "
+            f"{page.get('status', '')} |"
+        )
+
+    lines += ["", "### Counters", "", "| Counter | Value |", "|---|---:|"]
+    lines += [f"| {k} | {v} |" for k, v in sorted(totals["counters"].items())]
+
+    if baseline is not None:
+        lines += ["", f"### Regressions (more than {threshold:g}× slower)", ""]
+        found = list(regressions(websites, baseline, threshold))
+        lines += [f"* {n}: {b:.1f}s → {s:.1f}s" for n, b, s in found] or ["None"]
+    return "\n".join(lines)
+
+
+try:
+    arguments = docopt(__doc__, version="Metrics report 1.0")
+
+    loglevel = logging.INFO
+    if arguments["--verbose"]:
+        loglevel = logging.DEBUG
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)-8s %(message)s",
+        level=loglevel,
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    logging.captureWarnings(True)
+
+    summary, pages = summarize(arguments["<path>"])
+    baseline = None
+    if arguments["--baseline"]:
+        with open(arguments["--baseline"]) as f:
+            baseline = json.load(f)
+    print(
+        report(
+            summary,
+            pages,
+            top=int(arguments["--top"]),
+            baseline=baseline,
+            threshold=float(arguments["--threshold"]),
+        )
+    )
+    if arguments["--json"]:
+        with open(arguments["--json"], "w") as f:
+            json.dump(summary, f, indent=2)
+
+except Exception:
+    log.exception("Error in metrics_report.py")
+    sys.exit(1)
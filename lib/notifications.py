@@ -3,7 +3,7 @@
 """Send a notification message to Microsoft Teams
 
 Usage:
-  notifications.py --matches <matches-file> [--run-url <run-url>] [--dry-run] [--verbose] [--no-verify]
+  notifications.py --matches <matches-file> [--run-url <run-url>] [--dry-run] [--rate <per-second>] [--workers <num>] [--retries <num>] [--verbose] [--no-verify]
   notifications.py (-h | --help)
   notifications.py --version
 
@@ -13,18 +13,25 @@ Options:
   -m, --matches <matches-file>  Path to the JSONL file containing the matches.
   -r, --run-url <run-url>       URL to the current GitHub run.
   -d, --dry-run                 Only a dry run, no MS Teams notifications are sent.
+  --rate <per-second>           Maximum number of messages sent per second [default: 1].
+  --workers <num>               Number of messages sent at the same time [default: 4].
+  --retries <num>               Retries of a message if the webhook is throttled or fails [default: 5].
   --verbose                     Option to enable more verbose output.
+  --no-verify                   Option to disable SSL verification for requests.
 """  # noqa: E501
 
 import os
 import sys
 import logging
 import jsonlines
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import pymsteams
+import requests
 from docopt import docopt
 from dotenv import load_dotenv, find_dotenv
 import time
+from scheduler import Scheduler, TokenBucket
 from rich.table import Table
 from rich.console import Console
 from rich.markdown import Markdown
@@ -50,6 +57,56 @@ logging.basicConfig(
 )
 logging.captureWarnings(True)
 
+# max. number of facts per message, more matches are summarized in one fact
+MAX_FACTS = 50
+# seconds to wait before the first retry, doubled for every further retry
+RETRY_BACKOFF = 2
+
+
+def retry_after(response):
+    """Seconds to wait according to the Retry-After header, None if not set"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+def send_card(card, bucket, retries=5, verify=True):
+    """Post a card to the webhook, retry if it's throttled or fails"""
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        r = requests.post(
+            card.hookurl,
+            json=card.payload,
+            proxies=card.proxies,
+            timeout=card.http_timeout,
+            verify=verify,
+        )
+        card.last_http_response = r
+        if r.ok:
+            return r
+        throttled = r.status_code == 429
+        if attempt == retries or not (throttled or r.status_code >= 500):
+            raise pymsteams.TeamsWebhookException(f"{r.status_code}: {r.text}")
+        delay = retry_after(r)
+        if delay is None:
+            delay = RETRY_BACKOFF * 2**attempt
+        log.info(f"Webhook returned {r.status_code}, retry in {delay:.1f} seconds")
+        if throttled:
+            # the limit applies to the webhook, not only to this message
+            bucket.pause(delay)
+        else:
+            time.sleep(delay)
+
+
 try:  # noqa
     matches_path = arguments["--matches"]
     github_run_url = arguments["--run-url"]
@@ -59,6 +116,8 @@ try:  # noqa
 
     date_str = datetime.now().strftime("%d.%m.%Y")
     entries = {}
+    # facts of all groups, to skip duplicates in constant time
+    seen = set()
     # iterate over matches
     with jsonlines.open(matches_path) as reader:
         for r in reader:
@@ -75,7 +134,9 @@ try:  # noqa
                 "text": f"[{r['label']}]({r['url']}) ({r['type']}): {match['texts'][0]}",  # noqa
                 "url": r["url"],
             }
-            if fact not in entries[group]["facts"]:
+            key = (group, fact["keyword"], fact["text"], fact["url"])
+            if key not in seen:
+                seen.add(key)
                 entries[group]["facts"].append(fact)
 
     # sort facts
@@ -105,26 +166,19 @@ try:  # noqa
     # create cards
     cards = {}
     for k, v in entries.items():
-        if k in cards:
-            card = cards[k]["card"]
-            section = cards[k]["section"]
-        else:
-            card = pymsteams.connectorcard(team_webhook_url)
-            card.title(v["title"])
-            card.summary(v["title"])
-
-            section = pymsteams.cardsection()
-            card.addSection(section)
-            cards[k] = {
-                "card": card,
-                "section": section,
-            }
+        card = pymsteams.connectorcard(team_webhook_url)
+        card.title(v["title"])
+        card.summary(v["title"])
 
-        for fact in v["facts"]:
-            if len(section.dumpSection().get("facts", [])) < 50:
+        section = pymsteams.cardsection()
+        card.addSection(section)
+        cards[k] = card
+
+        for num_facts, fact in enumerate(v["facts"]):
+            if num_facts < MAX_FACTS:
                 section.addFact(fact["keyword"], fact["text"])
-            elif len(section.dumpSection().get("facts", [])) == 50:
-                section.addFact("...", "mehr als 50 Matches vorhanden...")
+            elif num_facts == MAX_FACTS:
+                section.addFact("...", f"mehr als {MAX_FACTS} Matches vorhanden...")
             else:
                 log.info("Can't add more facts to section, skipping.")
 
@@ -132,25 +186,36 @@ try:  # noqa
         log.info("Only a dry run, stopping...")
         sys.exit(0)
 
+    for card in cards.values():
+        if github_run_url:
+            card.addLinkButton("Logs anschauen", github_run_url)
+        card.color("3AB660")
+
+    workers = int(arguments["--workers"])
+    bucket = TokenBucket(rate=float(arguments["--rate"]), capacity=workers)
+    scheduler = Scheduler(workers=workers)
+
+    def send(group):
+        return send_card(
+            cards[group],
+            bucket,
+            retries=int(arguments["--retries"]),
+            verify=not arguments["--no-verify"],
+        )
+
     failed = False
-    for group, msg in cards.items():
-        try:
-            if github_run_url:
-                msg["card"].addLinkButton("Logs anschauen", github_run_url)
-
-            msg["card"].color("3AB660")
-
-            # Send the notification
-            msg["card"].send()
-            log.info(f'Send notification for "{group}"')
-            time.sleep(5)
-        except (pymsteams.TeamsWebhookException, requests.exceptions.RequestException):
-            # catch this exception here, so that all valid messages will be sent
-            # re-raise later
-            log.exception(f"Error when sending group {group}")
-            failed = True
-            time.sleep(5)
-            continue
+    try:
+        for group, future in scheduler.map_ordered(send, cards):
+            try:
+                future.result()
+                log.info(f'Send notification for "{group}"')
+            except (pymsteams.TeamsWebhookException, requests.RequestException):
+                # catch this exception here, so that all valid messages will be sent
+                # re-raise later
+                log.exception(f"Error when sending group {group}")
+                failed = True
+    finally:
+        scheduler.shutdown()
 
     if failed:
         raise Exception("There was an error sending a teams message, see above")
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Cache of HTTP validators and content digests of crawled pages
+
+The cache is stored as JSON Lines per website (`cache/<slug>.jsonl`): the
+first line holds the fingerprint of the keywords, followed by one entry per
+URL with the ETag and Last-Modified headers, a digest of the body and the
+links found on the page. If a page did not change since the last run,
+the crawler can skip parsing and matching and re-use the stored links.
+
+Pages that changed byte-wise (e.g. because of a session token or a timestamp)
+are parsed again, but if the fingerprints of their text and of their links
+are still the same, matching is skipped as well.
+
+Entries are looked up by the same key as in the visited set of the crawl (see
+`canonical_url`), the file holds the canonical URL of every entry.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+from canonical_url import canonicalize, url_key
+
+log = logging.getLogger(__name__)
+
+MAX_ENTRIES = 5000
+
+
+def content_digest(content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+def text_fingerprint(texts):
+    """Digest of the texts of a page with normalized whitespace"""
+    normalized = (" ".join(text.split()) for text in texts)
+    return content_digest("\n".join(text for text in normalized if text))
+
+
+def links_fingerprint(links):
+    """Digest of the set of URLs a page links to"""
+    return content_digest("\n".join(sorted({link[0] for link in links})))
+
+
+def keywords_fingerprint(keywords):
+    """Digest of the keywords, the cache is only valid for the same keywords"""
+    keywords_str = "\n".join(k["keyword"] for k in keywords)
+    return hashlib.sha256(keywords_str.encode("utf-8")).hexdigest()
+
+
+class PageCache:
+    """Validators and digests per URL, evicts the least recently used entries"""
+
+    def __init__(self, fingerprint="", entries=None, max_entries=MAX_ENTRIES):
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.text_hits = 0
+        self._entries = collections.OrderedDict(entries or {})
+
+    @classmethod
+    def load(cls, path, fingerprint="", max_entries=MAX_ENTRIES):
+        cache = cls(fingerprint, max_entries=max_entries)
+        if not path:
+            return cache
+        try:
+            with open(path) as f:
+                header = json.loads(f.readline())
+                if header.get("fingerprint") != fingerprint:
+                    log.info("Keywords changed since the cache was written.")
+                    return cache
+                for line in f:
+                    entry = json.loads(line)
+                    cache._entries[url_key(entry["url"])] = entry
+        except (IOError, ValueError):
+            log.info(f"Cache-File at {path} does not exist or is invalid.")
+            cache._entries.clear()
+        return cache
+
+    def __len__(self):
+        return len(self._entries)
+
+    def request_headers(self, url, need_links=False):
+        """Headers for a conditional GET request of the URL"""
+        entry = self._entries.get(url_key(url))
+        if not entry or (need_links and entry.get("links") is None):
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def lookup(self, url, digest=None, not_modified=False, need_links=False):
+        """Return the cached entry if the page did not change, None otherwise"""
+        key = url_key(url)
+        entry = self._entries.get(key)
+        unchanged = entry is not None and (
+            not_modified or (digest is not None and entry.get("digest") == digest)
+        )
+        if unchanged and need_links and entry.get("links") is None:
+            unchanged = False
+
+        if not unchanged:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def text_unchanged(self, url, text_digest, links=None):
+        """Check if the text (and the links) of a changed page are still the same"""
+        entry = self._entries.get(url_key(url))
+        if not entry or not text_digest or entry.get("text_digest") != text_digest:
+            return False
+        if links is not None and entry.get("links_digest") != links_fingerprint(links):
+            return False
+        self.text_hits += 1
+        return True
+
+    def put(self, url, digest, validators=None, links=None, text_digest=None):
+        key = url_key(url)
+        validators = validators or {}
+        has_links = links is not None
+        self._entries[key] = {
+            "url": canonicalize(url),
+            "etag": validators.get("etag"),
+            "last_modified": validators.get("last_modified"),
+            "digest": digest,
+            "text_digest": text_digest,
+            "links_digest": links_fingerprint(links) if has_links else None,
+            "links": [list(link) for link in links] if has_links else None,
+        }
+        self._entries.move_to_end(key)
+
+    def entry(self, url):
+        """Copy of the entry of a URL, e.g. to restore it later"""
+        entry = self._entries.get(url_key(url))
+        return dict(entry) if entry is not None else None
+
+    def restore(self, url, entry):
+        key = url_key(url)
+        self._entries[key] = {**entry, "url": canonicalize(url)}
+        self._entries.move_to_end(key)
+
+    def persist(self, path):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        with open(path, "w") as f:
+            f.write(json.dumps({"fingerprint": self.fingerprint}) + "\n")
+            for entry in self._entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        log.info(
+            f"Page cache: {self.hits} hits, {self.misses} misses of {total} pages "
+            f"({self.text_hits} with unchanged text), {len(self)} entries"
+        )
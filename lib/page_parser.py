@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""HTML parsers that extract the text nodes, the title and the links of a page
+
+The crawler only needs the strings of a page, its `<title>` and its `<a href>`
+tags, so besides BeautifulSoup (with html.parser or lxml) there is a
+streaming parser that extracts only these parts without building a tree. It
+follows the rules of BeautifulSoup with html.parser (how strings are merged,
+which strings are text, how unclosed tags are popped, what `.string` of a tag
+is), so it gives the same results, which can be checked with `parser_diff.py`.
+"""
+
+import collections
+import html.parser
+import re
+from bs4 import BeautifulSoup, FeatureNotFound
+from bs4.builder import HTMLParserTreeBuilder
+from bs4.dammit import EntitySubstitution, UnicodeDammit
+from page_cache import text_fingerprint
+
+PARSERS = ("html.parser", "lxml", "stream")
+
+_DECIMAL_REFERENCE = re.compile("^([0-9]+)(.*)")
+_HEX_REFERENCE = re.compile("^([0-9a-f]+)(.*)")
+
+# `texts` are (string, text) tuples of all strings of the page, `text_digest` the
+# fingerprint of all strings and `anchors` the (href, string) tuples of the links.
+# Keywords are searched in the string (like with `find_all(string=regex)`), the
+# text is what `get_text(strip=True)` returns for it: the stripped string, but
+# nothing for scripts, styles, comments and templates
+ParsedHtml = collections.namedtuple(
+    "ParsedHtml", ["texts", "text_digest", "title", "anchors"]
+)
+
+
+def _plain(string):
+    return None if string is None else str(string)
+
+
+def _parse_soup(content, features, link_limit):
+    soup = BeautifulSoup(content, features)
+    strings = soup.find_all(string=True)
+    texts = [(str(s), s.get_text(strip=True)) for s in strings]
+    # only plain strings are kept, so the soup can be freed
+    title = _plain(soup.title.string) if soup.title else None
+    anchors = tuple(
+        (link["href"], _plain(link.string))
+        for link in soup.find_all("a", href=True, limit=link_limit)
+    )
+    return ParsedHtml(texts, text_fingerprint(strings), title, anchors)
+
+
+class _Element:
+    """Open tag of the streaming parser, `children` are only kept if needed"""
+
+    __slots__ = ("name", "children")
+
+    def __init__(self, name, children=None):
+        self.name = name
+        self.children = children
+
+    @property
+    def string(self):
+        """Same as `Tag.string` of BeautifulSoup"""
+        if not self.children or len(self.children) != 1:
+            return None
+        child = self.children[0]
+        return child if isinstance(child, str) else child.string
+
+
+class StreamParser(html.parser.HTMLParser):
+    """Extract strings, title and links like BeautifulSoup with html.parser"""
+
+    _builder = HTMLParserTreeBuilder()
+    EMPTY_ELEMENT_TAGS = _builder.empty_element_tags
+    PRESERVE_WHITESPACE_TAGS = _builder.preserve_whitespace_tags
+    STRING_CONTAINER_TAGS = set(_builder.string_containers)
+    ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+    def __init__(self, link_limit):
+        super().__init__(convert_charrefs=False)
+        self.link_limit = link_limit
+        self.strings = []
+        self.texts = []
+        self.title = None
+        self.links = []
+        self._stack = [_Element(None)]
+        self._open_tags = collections.Counter()
+        self._preserve_whitespace = 0
+        self._string_containers = 0
+        self._current_data = []
+        self._already_closed_empty_element = []
+
+    def _push(self, name, attrs):
+        parent = self._stack[-1]
+        children = [] if parent.children is not None else None
+        if name == "title" and self.title is None:
+            children = []
+            self.title = _Element(name, children)
+            element = self.title
+        elif name == "a" and "href" in attrs and len(self.links) < self.link_limit:
+            element = _Element(name, [])
+            self.links.append((attrs["href"], element))
+        else:
+            element = _Element(name, children)
+        if parent.children is not None:
+            parent.children.append(element)
+        self._stack.append(element)
+        self._open_tags[name] += 1
+        if name in self.PRESERVE_WHITESPACE_TAGS:
+            self._preserve_whitespace += 1
+        if name in self.STRING_CONTAINER_TAGS:
+            self._string_containers += 1
+
+    def _pop(self):
+        element = self._stack.pop()
+        self._open_tags[element.name] -= 1
+        if element.name in self.PRESERVE_WHITESPACE_TAGS:
+            self._preserve_whitespace -= 1
+        if element.name in self.STRING_CONTAINER_TAGS:
+            self._string_containers -= 1
+
+    def _pop_to_tag(self, name):
+        for element in reversed(self._stack[1:]):
+            if not self._open_tags[name]:
+                break
+            self._pop()
+            if element.name == name:
+                break
+
+    def end_data(self, kind="text"):
+        if not self._current_data:
+            return
+        data = "".join(self._current_data)
+        self._current_data = []
+        if not self._preserve_whitespace and not data.strip(self.ASCII_SPACES):
+            data = "\n" if "\n" in data else " "
+
+        self.strings.append(data)
+        # strings in scripts, styles and templates have no text
+        is_text = kind == "cdata" or (kind == "text" and not self._string_containers)
+        self.texts.append((data, data.strip() if is_text else ""))
+        parent = self._stack[-1]
+        if parent.children is not None:
+            parent.children.append(data)
+
+    def handle_starttag(self, tag, attrs, handle_empty_element=True):
+        # the last value of duplicate attributes wins, missing values are ""
+        attr_dict = {key: "" if value is None else value for key, value in attrs}
+        self.end_data()
+        self._push(tag, attr_dict)
+        if tag in self.EMPTY_ELEMENT_TAGS and handle_empty_element:
+            self.handle_endtag(tag, check_already_closed=False)
+            self._already_closed_empty_element.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, handle_empty_element=False)
+        self.handle_endtag(tag, check_already_closed=False)
+
+    def handle_endtag(self, tag, check_already_closed=True):
+        if check_already_closed and tag in self._already_closed_empty_element:
+            self._already_closed_empty_element.remove(tag)
+        else:
+            self.end_data()
+            self._pop_to_tag(tag)
+
+    def handle_data(self, data):
+        self._current_data.append(data)
+
+    def handle_charref(self, name):
+        base, reference = 10, _DECIMAL_REFERENCE
+        if name.startswith(("x", "X")):
+            base, reference, name = 16, _HEX_REFERENCE, name[1:]
+        extra_data = ""
+        try:
+            number = int(name, base)
+        except ValueError:
+            # a reference without a semicolon, the rest is normal data
+            m = reference.search(name)
+            number = int(m.group(1), base) if m else None
+            extra_data = m.group(2) if m else name
+        if number is not None:
+            self.handle_data(UnicodeDammit.numeric_character_reference(number)[0])
+        self.handle_data(extra_data)
+
+    def handle_entityref(self, name):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.handle_data(character if character is not None else f"&{name}")
+
+    def _handle_special(self, data, kind):
+        self.end_data()
+        self.handle_data(data)
+        self.end_data(kind)
+
+    def handle_comment(self, data):
+        self._handle_special(data, "comment")
+
+    def handle_decl(self, decl):
+        self._handle_special(decl[len("DOCTYPE ") :], "doctype")
+
+    def unknown_decl(self, data):
+        if data.upper().startswith("CDATA["):
+            self._handle_special(data[len("CDATA[") :], "cdata")
+        else:
+            self._handle_special(data, "declaration")
+
+    def handle_pi(self, data):
+        self._handle_special(data, "pi")
+
+    def parse(self, markup):
+        self.feed(markup)
+        self.close()
+        self.end_data()
+        title = self.title.string if self.title is not None else None
+        anchors = tuple((href, element.string) for href, element in self.links)
+        return ParsedHtml(self.texts, text_fingerprint(self.strings), title, anchors)
+
+
+def _parse_stream(content, link_limit):
+    if isinstance(content, bytes):
+        content = UnicodeDammit(content, is_html=True).unicode_markup
+    return StreamParser(link_limit).parse(content)
+
+
+def parse_html(content, parser="html.parser", link_limit=500):
+    """Parse HTML with one of the PARSERS"""
+    if parser == "stream":
+        return _parse_stream(content, link_limit)
+    if parser in PARSERS:
+        return _parse_soup(content, parser, link_limit)
+    raise ValueError(f"Invalid parser: {parser}")
+
+
+def check_parser(parser):
+    """Make sure a parser exists and its dependencies are installed"""
+    if parser not in PARSERS:
+        raise ValueError(f"Invalid parser: {parser}")
+    if parser == "lxml":
+        try:
+            BeautifulSoup("", "lxml")
+        except FeatureNotFound:
+            raise ValueError("The lxml parser needs the lxml package to be installed")
+    return parser
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compare the HTML parsers on saved pages of the monitored websites
+
+The `save` command downloads the start pages of all active static websites of
+the CSVs to the corpus directory, `check` parses every saved page with
+html.parser (the reference) and with the other parsers and compares the texts,
+the title and the links. The matches of all keyword files are compared with the
+ones of the original matcher, which searched every keyword in the whole soup
+with `find_all(string=regex)`, for html.parser as well as for the other parsers.
+
+Usage:
+  parser_diff.py save --corpus <dir> <csv>... [--verbose] [--no-verify]
+  parser_diff.py check --corpus <dir> [<keywords>...] [--parser <name>]... [--verbose]
+  parser_diff.py (-h | --help)
+  parser_diff.py --version
+
+Options:
+  -h, --help                    Show this screen.
+  --version                     Show version.
+  --corpus <dir>                Directory with the saved pages.
+  --parser <name>               Parser to compare with html.parser [default: stream].
+  --verbose                     Option to enable more verbose output.
+  --no-verify                   Option to disable SSL verification for requests.
+"""  # noqa: E501
+
+import csv
+import glob
+import hashlib
+import logging
+import os
+import re
+import sys
+import time
+from bs4 import BeautifulSoup
+from docopt import docopt
+import urllib3
+import download as dl
+from crawler import LINK_LIMIT, load_keywords, match_html
+from page_parser import check_parser, parse_html
+
+log = logging.getLogger(__name__)
+
+REFERENCE_PARSER = "html.parser"
+
+
+def save_corpus(csv_paths, corpus_dir, verify=True):
+    os.makedirs(corpus_dir, exist_ok=True)
+    for csv_path in csv_paths:
+        with open(csv_path, newline="") as f:
+            rows = [row for row in csv.DictReader(f) if row["active"] == "yes"]
+        for row in rows:
+            if row["type"] != "static":
+                log.info(f"Skip dynamic website {row['slug']}")
+                continue
+            try:
+                with dl.fetch(row["url"], verify=verify) as (content_type, r):
+                    if "text/html" not in content_type:
+                        log.info(f"Skip {content_type} of {row['slug']}")
+                        continue
+                    content = dl.read_content(r)
+            except Exception:
+                log.exception(f"Error when saving {row['url']}")
+                continue
+            with open(os.path.join(corpus_dir, f"{row['slug']}.html"), "wb") as f:
+                f.write(content)
+            log.info(f"Saved {row['url']} ({len(content)} bytes)")
+
+
+def timed_parse(content, parser):
+    start = time.perf_counter()
+    parsed = parse_html(content, parser, link_limit=LINK_LIMIT)
+    return parsed, time.perf_counter() - start
+
+
+def find_all_matches(soup, keywords):
+    """Matches of the original matcher, which searched the soup for each keyword"""
+    matches = []
+    for kw_re in keywords:
+        source_list = []
+        source_hashes = []
+        for elem in soup.find_all(string=kw_re["re"]):
+            text = elem.get_text(strip=True)
+            text = text.replace("\n\n", "\n")
+            text = text.replace("\n", " ")
+            text = text.replace("  ", " ")
+            if not re.search(r"\w", text):
+                continue
+            m = kw_re["re"].search(text)
+            short_text = text[max(0, m.start() - 70) : m.end() + 70]
+            hl_text = kw_re["re"].sub(r"**\1**", short_text)
+            source_list.append(f"…{hl_text}…")
+            source_hashes.append(hashlib.sha256(text.encode("utf-8")).hexdigest())
+        if source_list:
+            matches.append(
+                {
+                    "keyword": kw_re["keyword"],
+                    "texts": list(set(source_list)),
+                    "hashes": source_hashes,
+                }
+            )
+    return matches
+
+
+def comparable(matches):
+    # the order of the unique texts of a keyword is arbitrary
+    return [(m["keyword"], sorted(m["texts"]), m["hashes"]) for m in matches]
+
+
+def baseline_matches(content, keyword_sets):
+    """Matches of the original matcher by name of the keyword file"""
+    soup = BeautifulSoup(content, REFERENCE_PARSER)
+    return {
+        name: comparable(find_all_matches(soup, keywords))
+        for name, keywords in keyword_sets
+    }
+
+
+def diff_page(reference, parsed, baseline, keyword_sets):
+    """Names of the parts of a parsed page that differ from the reference
+
+    The matches are compared with the ones of the original matcher.
+    """
+    diffs = [
+        f
+        for f in reference._fields
+        if f != "texts" and getattr(reference, f) != getattr(parsed, f)
+    ]
+    # strings without text (like the doctype, which lxml drops) never match
+    if [t for t in reference.texts if t[1]] != [t for t in parsed.texts if t[1]]:
+        diffs.append("texts")
+    for name, keywords in keyword_sets:
+        if comparable(match_html(parsed.texts, keywords, set())) != baseline[name]:
+            diffs.append(f"matches of {name}")
+    return diffs
+
+
+def check_corpus(corpus_dir, keyword_paths, parsers):
+    keyword_sets = [(os.path.basename(p), load_keywords(p)) for p in keyword_paths]
+    paths = sorted(glob.glob(os.path.join(corpus_dir, "*.html")))
+    if not paths:
+        raise ValueError(f"No saved pages in {corpus_dir}")
+
+    durations = {parser: 0.0 for parser in (REFERENCE_PARSER, *parsers)}
+    failed = []
+    for path in paths:
+        with open(path, "rb") as f:
+            content = f.read()
+        results = {}
+        for parser in durations:
+            results[parser], duration = timed_parse(content, parser)
+            durations[parser] += duration
+        baseline = baseline_matches(content, keyword_sets)
+        for parser, parsed in results.items():
+            diffs = diff_page(results[REFERENCE_PARSER], parsed, baseline, keyword_sets)
+            if diffs:
+                log.error(f"{parser} differs for {path}: {', '.join(diffs)}")
+                failed.append((parser, path))
+
+    for parser, duration in durations.items():
+        log.info(f"{parser}: {len(paths)} pages parsed in {duration:.2f}s")
+    return failed
+
+
+try:
+    arguments = docopt(__doc__, version="Compare HTML parsers 1.0")
+
+    loglevel = logging.INFO
+    if arguments["--verbose"]:
+        loglevel = logging.DEBUG
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)-8s %(message)s",
+        level=loglevel,
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    logging.captureWarnings(True)
+    logging.getLogger("crawler").setLevel(logging.WARNING)
+
+    if arguments["save"]:
+        verify = not arguments["--no-verify"]
+        if not verify:
+            urllib3.disable_warnings()
+        save_corpus(arguments["<csv>"], arguments["--corpus"], verify=verify)
+    else:
+        parsers = [check_parser(p) for p in arguments["--parser"]]
+        failed = check_corpus(arguments["--corpus"], arguments["<keywords>"], parsers)
+        if failed:
+            raise Exception(f"{len(failed)} pages are parsed differently")
+        log.info("All parsers give the same results")
+
+except Exception:
+    log.exception("Error in parser_diff.py")
+    sys.exit(1)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Text extraction of PDFs with pdftotext
+
+A PDF is converted in ranges of pages that are extracted in parallel, the
+text is written to a cache file named after the SHA-256 of the PDF, so the
+same PDF is never converted twice (even across runs, if the cache directory
+is kept). The paragraphs are then read lazily from the cache file.
+"""
+
+import atexit
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from scheduler import Scheduler
+
+log = logging.getLogger(__name__)
+
+PAGES_PER_CHUNK = 10
+WORKERS = 4
+# number of text files that are kept in the cache directory
+MAX_FILES = 500
+READ_SIZE = 64 * 1024
+PARAGRAPH_SEPARATOR = "\n\n"
+
+
+def page_count(path):
+    """Number of pages of a PDF according to pdfinfo, None if it's unknown"""
+    p = subprocess.run(["pdfinfo", path], stdout=subprocess.PIPE)
+    m = re.search(rb"^Pages:\s+(\d+)", p.stdout, re.MULTILINE)
+    return int(m.group(1)) if m else None
+
+
+def pdftotext(path, first=None, last=None, encoding="utf-8"):
+    pdf_command = ["pdftotext"]
+    if first:
+        pdf_command += ["-f", str(first), "-l", str(last or first)]
+    pdf_command += [path, "-"]
+    p = subprocess.run(pdf_command, stdout=subprocess.PIPE)
+    if p.returncode != 0:
+        log.warning(f"pdftotext exited with {p.returncode} for pages {first}-{last}")
+    return p.stdout.decode(encoding)
+
+
+def extract_chunks(path, workers=WORKERS, pages_per_chunk=PAGES_PER_CHUNK):
+    """Extract the text of a PDF in ranges of pages, yields the texts in order"""
+    pages = page_count(path)
+    if not pages or pages <= pages_per_chunk:
+        yield pdftotext(path)
+        return
+
+    ranges = [
+        (first, min(first + pages_per_chunk - 1, pages))
+        for first in range(1, pages + 1, pages_per_chunk)
+    ]
+    log.debug(f"Extract {pages} pages of {path} in {len(ranges)} chunks")
+    scheduler = Scheduler(workers=workers)
+    try:
+        for _, future in scheduler.map_ordered(
+            lambda r: pdftotext(path, r[0], r[1]), ranges
+        ):
+            yield future.result()
+    finally:
+        scheduler.shutdown()
+
+
+def split_paragraphs(chunks):
+    """Split texts on empty lines, paragraphs may span several chunks
+
+    The result is the same as joining all chunks and splitting them once.
+    """
+    rest = ""
+    for chunk in chunks:
+        paragraphs = (rest + chunk).split(PARAGRAPH_SEPARATOR)
+        rest = paragraphs.pop()
+        yield from paragraphs
+    yield rest
+
+
+class PdfText:
+    """Text of a PDF in a file, iterating over it yields the paragraphs"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _chunks(self):
+        with open(self.path, encoding="utf-8", newline="") as f:
+            while True:
+                chunk = f.read(READ_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def __iter__(self):
+        return split_paragraphs(self._chunks())
+
+    def __str__(self):
+        return "".join(self._chunks())
+
+
+class PdfTextCache:
+    """Directory with the extracted texts of PDFs, named after their SHA-256
+
+    Without a directory, a temporary one is used that only lives as long as
+    the process.
+    """
+
+    def __init__(self, directory=None, max_files=MAX_FILES, workers=WORKERS):
+        self.directory = directory
+        self.max_files = max_files
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        self._tmp = None
+        self._lock = threading.Lock()
+
+    def _directory(self):
+        with self._lock:
+            if self.directory is None:
+                self._tmp = tempfile.TemporaryDirectory(prefix="pdf_text_")
+                self.directory = self._tmp.name
+            os.makedirs(self.directory, exist_ok=True)
+            return self.directory
+
+    def text(self, digest, pdf_path):
+        """Text of the PDF at pdf_path, it's only extracted if it's not cached"""
+        path = os.path.join(self._directory(), f"{digest}.txt")
+        if os.path.exists(path):
+            log.info(f"PDF {digest} already converted, use cached text")
+            self.hits += 1
+            os.utime(path)
+            return PdfText(path)
+
+        self.misses += 1
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            for chunk in extract_chunks(pdf_path, workers=self.workers):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+        return PdfText(path)
+
+    def prune(self):
+        """Remove the least recently used texts, if there are more than max_files"""
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        paths = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".txt")
+        ]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[self.max_files :]:
+            os.remove(path)
+
+    def close(self):
+        if self.hits or self.misses:
+            log.info(f"PDF text cache: {self.hits} hits, {self.misses} conversions")
+            self.hits = self.misses = 0
+        if self._tmp is not None:
+            self._tmp.cleanup()
+            self._tmp = None
+            self.directory = None
+        else:
+            self.prune()
+
+
+cache = PdfTextCache()
+atexit.register(lambda: cache.close())
+
+
+def configure_cache(**kwargs):
+    """Replace the shared cache, e.g. to keep the texts in a directory"""
+    global cache
+    cache.close()
+    cache = PdfTextCache(**kwargs)
+    return cache
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Concurrent fetching of pages with per-host politeness limits"""
+
+import collections
+import contextlib
+import logging
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class HostLimiter:
+    """Limit concurrent requests and the request rate per host
+
+    At most `max_concurrent` requests run at the same time for a host and
+    there are at least `delay` seconds between the start of two requests.
+    """
+
+    def __init__(self, max_concurrent=2, delay=1.0):
+        self.max_concurrent = max_concurrent
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_start = {}
+
+    @contextlib.contextmanager
+    def slot(self, url):
+        """Wait for a free slot of the host, yields the seconds waited"""
+        requested = time.monotonic()
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_concurrent)
+            semaphore = self._semaphores[host]
+
+        with semaphore:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start + self.delay
+            wait = start - now
+            if wait > 0:
+                log.debug(f"Wait {wait:.1f} seconds before requesting {host}")
+                time.sleep(wait)
+            yield time.monotonic() - requested
+
+
+class Scheduler:
+    """Thread pool with a bounded number of pending fetches"""
+
+    def __init__(self, workers=4, max_pending=None):
+        self.workers = workers
+        self.max_pending = max_pending or workers * 2
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, func, *args, **kwargs):
+        return self._executor.submit(func, *args, **kwargs)
+
+    def map_ordered(self, func, items):
+        """Run func on all items concurrently and yield the futures in order
+
+        Only `max_pending` items are submitted ahead of the one that is
+        currently consumed, so the frontier stays bounded. The caller gets
+        (item, future) tuples in the same order as the items.
+        """
+        pending = collections.deque()
+        try:
+            for item in items:
+                pending.append((item, self.submit(func, item)))
+                if len(pending) >= self.max_pending:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class TokenBucket:
+    """Limit the rate of events to `rate` per second, with bursts of `capacity`
+
+    A `pause` (e.g. because the server asked for it) stops all events until
+    the given number of seconds has passed.
+    """
+
+    def __init__(self, rate=1.0, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a token is available and take it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._updated
+                self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+                self._updated = now
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._paused_until = max(self._paused_until, until)
@@ -3,7 +3,7 @@
 """Match keywords against a website content
 
 Usage:
-  website_matcher.py --url <url-of-website> --label <label> --group <group> --file <path> --keywords <path> --new <path> [--wait <seconds>] [--output <path>] [--type <type>] [--verbose] [--no-verify]
+  website_matcher.py --url <url-of-website> --label <label> --group <group> --file <path> --keywords <path> --new <path> [--wait <seconds>] [--output <path>] [--type <type>] [--workers <num>] [--host-concurrency <num>] [--delay <seconds>] [--cache <path>] [--new-cache <path>] [--parser <name>] [--pdf-cache <dir>] [--deadline <seconds>] [--max-pages <num>] [--max-bytes <num>] [--max-response-bytes <num>] [--status <path>] [--checkpoint <path> [--resume] [--run-id <id>]] [--scope <scope>] [--include <regex>]... [--exclude <regex>]... [--probe] [--metrics <path>] [--tabs <num>] [--ready <strategy>] [--selector <css>] [--block-resources <mode>] [--verbose] [--no-verify]
   website_matcher.py (-h | --help)
   website_matcher.py --version
 
@@ -13,243 +13,67 @@ Options:
   -u, --url <url-of-website>    URL of the website to monitor.
   -l, --label <label>           Label of the URL.
   -g, --group <group>           Label of the group of URLs.
-  -f, --file <path>             Load the hashes of the output from file.
+  -f, --file <path>             Load the hashes of the output from file (*.bin for the compact format).
   -k, --keywords <path>         Load the keywords from file.
   -n, --new <path>              Save the new hashes of the output in file.
   -w, --wait <seconds>          Number of seconds to wait for the page to load [default: 3].
   -t, --type <type>             Type of website, one [default: static].
   -o, --output <path>           Save the matched output to a file.
+  --workers <num>               Number of pages that are fetched concurrently [default: 4].
+  --host-concurrency <num>      Maximum number of concurrent requests per host [default: 2].
+  --delay <seconds>             Minimum delay between two requests to the same host [default: 1].
+  -c, --cache <path>            Load the page cache (HTTP validators and digests) from file.
+  --new-cache <path>            Save the updated page cache to file.
+  --parser <name>               HTML parser: html.parser, lxml or stream (only extracts texts and links) [default: html.parser].
+  --pdf-cache <dir>             Keep the texts of converted PDFs in this directory.
+  --deadline <seconds>          Stop the crawl after this many seconds and keep what was found so far.
+  --max-pages <num>             Stop the crawl after this many fetched pages.
+  --max-bytes <num>             Stop the crawl after this many downloaded bytes.
+  --max-response-bytes <num>    Skip pages that are larger than this many bytes.
+  --status <path>               Save the status of the crawl (complete or partial, pages, bytes) to a JSON file.
+  --checkpoint <path>           Save the crawled pages to this file while crawling, it's removed when the crawl is complete.
+  --resume                      Continue the crawl of the checkpoint, pages that are in it are not fetched again.
+  --run-id <id>                 Only resume a checkpoint of the same run (e.g. the GitHub run ID).
+  --scope <scope>               Links that are followed: any, host (same host as the URL) or prefix (same host and path prefix) (default: any).
+  --include <regex>             Follow links matching this pattern even if they are out of scope.
+  --exclude <regex>             Never follow links matching this pattern.
+  --probe                       Check the content type of links with unknown file extensions with a HEAD request first.
+  --metrics <path>              Save the timings of all stages per URL and the counters of the run to a JSONL file.
+  --tabs <num>                  Maximum number of pages rendered concurrently with Selenium [default: 2].
+  --ready <strategy>            When a dynamic page is ready: fixed, stable, selector or network-idle, --wait is the upper bound (default: fixed or selector if --selector is set).
+  --selector <css>              CSS selector of an element that must exist before a dynamic page is ready.
+  --block-resources <mode>      Resources that are not loaded for dynamic pages: all (images, fonts, media, CSS and trackers), media (all except CSS) or none (default: all).
   --verbose                     Option to enable more verbose output.
   --no-verify                   Option to disable SSL verification for requests.
 """  # noqa: E501
 
 import os
-import hashlib
 import logging
-import re
 import sys
-import urllib.parse
-from pprint import pformat
-from bs4 import BeautifulSoup
 from docopt import docopt
-import jsonlines
 import urllib3
-import random
-import time
-from requests.exceptions import RequestException
-from selenium.common.exceptions import WebDriverException
 import download as dl
+import pdf_text
+from budget import CrawlBudget, budget_options
+from checkpoint import Checkpoint
+from link_filter import LinkFilter, link_filter_options
+from crawler import Crawler, check_website, load_keywords, render_options
+from hash_store import load_hash_store
+from page_cache import PageCache, keywords_fingerprint
+from page_parser import check_parser
+from scheduler import HostLimiter, Scheduler
 
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 log = logging.getLogger(__name__)
 
 
-def load_keywords(path):
-    keywords = []
-    with open(path) as f:
-        keywords = [line.strip() for line in f if line.strip()]
-
-    regex_keywords = [
-        {"re": re.compile(rf"\b({k})\b", re.IGNORECASE), "keyword": k} for k in keywords
-    ]
-    return regex_keywords
-
-
-def load_old_hashes(path):
-    old_hashes = []
-    try:
-        with open(path) as f:
-            old_hashes = [line.strip() for line in f]
-    except IOError:
-        log.info(f"Hash-File at {path} does not exist.")
-
-    return old_hashes
-
-
-def match_texts(texts, keywords, old_hashes):
-    matches = []
-    for text in texts:
-        matched_keywords = list(filter(lambda k: k["re"].search(text), keywords))
-        if not matched_keywords:
-            continue
-
-        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
-        log.debug(f"Check against hash list to see if it's new: {text_hash}")
-
-        if text_hash in old_hashes:
-            log.debug("Text already known, no new match.")
-            continue
-
-        log.info("New match found!")
-        # add highlights to text
-        for k in matched_keywords:
-            m = k["re"].search(text)
-            short_text = text[max(0, m.start() - 70) : m.end() + 70]
-            hl_text = k["re"].sub(r"**\1**", short_text)
-            matches.append(
-                {
-                    "keyword": k["keyword"],
-                    "texts": [f"…{hl_text}…"],
-                    "hashes": [text_hash],
-                }
-            )
-
-    return matches
-
-
-def match_html(soup, keywords, old_hashes):
-    matches = []
-    for kw_re in keywords:
-        log.info(f"Check keyword: {kw_re['keyword']}")
-        texts = soup.find_all(string=kw_re["re"])
-
-        source_list = []
-        source_hashes = []
-        for elem in texts:
-            text = elem.get_text(strip=True)
-            text = text.replace("\n\n", "\n")
-            text = text.replace("\n", " ")
-            text = text.replace("  ", " ")
-            text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
-            log.debug(f"Check against hash list to see if it's new: {text_hash}")
-            if text_hash in old_hashes:
-                log.info("Text already known, no new match.")
-                continue
-
-            if not re.search(r"\w", text):
-                log.info("Text has no word-characters in it, skipping...")
-                continue
-
-            log.info(f"New match found in {url}!")
-            # add highlights to text
-            m = kw_re["re"].search(text)
-            short_text = text[max(0, m.start() - 70) : m.end() + 70]
-            hl_text = kw_re["re"].sub(r"**\1**", short_text)
-            source_list.append(f"…{hl_text}…")
-            source_hashes.append(text_hash)
-
-        unique_source_list = list(set(source_list))
-        if len(unique_source_list) > 0:
-            log.debug("Unique list:")
-            log.debug(pformat(unique_source_list))
-            matches.append(
-                {
-                    "keyword": kw_re["keyword"],
-                    "texts": unique_source_list,
-                    "hashes": source_hashes,
-                }
-            )
-    return matches
-
-
-def get_content(url, timeout, dl_type, verify):
-    log.info(f"Get content from URL {url}")
-    delay = random.randint(1,5)
-    log.info(f"Wait for {delay} second delay")
-    time.sleep(delay)
-    try:
-        content_type = dl.get_content_type(url, verify=verify)
-        if "application/pdf" in content_type:
-            content = dl.pdfdownload(url)
-            return (content_type, content)
-
-        if "text" not in content_type:
-            raise ValueError(
-                f"Unsupported content type: {content_type}, skipping URL {url}"
-            )
-        if dl_type == "static":
-            content = dl.download_content(url, verify=verify)
-        elif dl_type == "dynamic":
-            content = dl.download_with_selenium(url, timeout)
-        else:
-            raise Exception(f"Invalid type: {dl_type}")
-        return (content_type, content)
-    except (RequestException, WebDriverException, ValueError):
-        log.exception(f"Error when trying to request from URL: {url}")
-        raise ValueError(f"Error when trying to request from URL: {url}")
-
-
-def get_title(soup, label):
-    try:
-        return soup.title.string.strip() or label
-    except AttributeError:
-        return label
-
-
-def crawl_urls(
-    url, label, group, timeout, level, dl_type, keywords, old_hashes, verify=True
-):
-    if level >= 2 or not url:
-        log.debug(f"Level: {level}, URL: {url}, skipping..")
-        return
-
-    global all_urls
-    if url in all_urls:
-        log.debug(f"URL '{url}' already crawled. Skipping...")
-        return
-    all_urls.append(url)
-
-    try:
-        content_type, content = get_content(url, timeout, dl_type, verify)
-    except ValueError:
-        if level == 0:
-            raise
-        # if a sub-page returns an error, silently ignore it
-        return
-
-    if "application/pdf" in content_type:
-        split_text = content.split("\n\n")
-        matches = match_texts(split_text, keywords, old_hashes)
-        log.debug(f"Matches: {matches}")
-
-        source_type = "PDF"
-        title = label
-
-        # create empty soup for PDFs
-        soup = BeautifulSoup("", "html.parser")
-    else:
-        soup = BeautifulSoup(content, "html.parser")
-        matches = match_html(soup, keywords, old_hashes)
-        source_type = "HTML"
-        title = get_title(soup, label)
-
-    if matches:
-        yield {
-            "type": source_type,
-            "group": group,
-            "url": url,
-            "label": title,
-            "matches": matches,
-        }
-
-    # find all links with href attribute, limit to 500 results
-    for link in soup.find_all("a", href=True, limit=500):
-        href = link["href"]
-        # skip empty or anchor links
-        if not href or href.startswith("#") or href.startswith("mailto:") or href.startswith("javascript:"):
-            continue
-        absolute_url = urllib.parse.urljoin(url, href)
-
-        link_text = link.string or label
-        yield from crawl_urls(
-            absolute_url,
-            link_text.strip(),
-            group,
-            timeout,
-            level + 1,
-            dl_type,
-            keywords,
-            old_hashes,
-            verify,
-        )
-
-
 try:
     arguments = docopt(__doc__, version="Match website 2.0")
 
     loglevel = logging.INFO
     if arguments["--verbose"]:
         log.setLevel(logging.DEBUG)
+        logging.getLogger("crawler").setLevel(logging.DEBUG)
 
     logging.basicConfig(
         format="%(asctime)s %(levelname)-8s %(message)s",
@@ -268,48 +92,89 @@ try:
     dl_type = arguments["--type"]
     verify = not arguments["--no-verify"]
     output = arguments["--output"]
+    limiter = HostLimiter(
+        max_concurrent=int(arguments["--host-concurrency"]),
+        delay=float(arguments["--delay"]),
+    )
+    scheduler = Scheduler(workers=int(arguments["--workers"]))
+    dl.configure_browser_pool(max_tabs=int(arguments["--tabs"]))
+    if arguments["--pdf-cache"]:
+        pdf_text.configure_cache(directory=arguments["--pdf-cache"])
+    options = render_options(
+        arguments["--ready"], arguments["--selector"], arguments["--block-resources"]
+    )
+    budget = CrawlBudget(
+        **budget_options(
+            arguments["--deadline"],
+            arguments["--max-pages"],
+            arguments["--max-bytes"],
+            arguments["--max-response-bytes"],
+        )
+    )
 
     if not verify:
         urllib3.disable_warnings()
 
     keywords = load_keywords(keywords_path)
-    hashes = load_old_hashes(file_path)
-
-    all_urls = []
-
-    try:
-        written_to_file = False
-        with jsonlines.open(output, mode="w") as writer:
-            for result in crawl_urls(
-                url, label, group, timeout, 0, dl_type, keywords, hashes, verify
-            ):
-                texts = []
-                for match in result["matches"]:
-                    hashes.extend(match["hashes"])
-
-                log.debug("Match result:")
-                log.debug(pformat(result))
-                writer.write(result)
-                written_to_file = True
-    except ValueError:
-        # make sure to remove the created file if there was an error and no write occured
-        # because the existence of this file indicates a successful check of the website
-        if not written_to_file:
-            log.error("Error occured when crawling the website, deleting output file")
-            os.remove(output)
-        raise
+    hashes = load_hash_store(file_path)
 
+    page_cache = None
+    new_cache_path = arguments["--new-cache"]
+    if arguments["--cache"] or new_cache_path:
+        page_cache = PageCache.load(
+            arguments["--cache"], fingerprint=keywords_fingerprint(keywords)
+        )
 
-    log.info("Write new hash file...")
-    hashes = list(set(hashes))
-    hashes.sort()
-    hashes_str = "\n".join(hashes)
-    with open(new_path, "w") as f:
-        f.write(hashes_str)
-    log.info(f"Hashes: {hashes_str}")
+    checkpoint = None
+    if arguments["--checkpoint"]:
+        checkpoint = Checkpoint.open(
+            arguments["--checkpoint"],
+            url,
+            fingerprint=keywords_fingerprint(keywords),
+            resume=arguments["--resume"],
+            run_id=arguments["--run-id"],
+        )
 
-    url_str = "\n".join(all_urls)
-    log.info(f"All checked URLs: {url_str}")
+    crawler = Crawler(
+        group,
+        keywords,
+        hashes,
+        timeout=timeout,
+        dl_type=dl_type,
+        verify=verify,
+        parser=check_parser(arguments["--parser"]),
+        scheduler=scheduler,
+        limiter=limiter,
+        page_cache=page_cache,
+        budget=budget,
+        checkpoint=checkpoint,
+        link_filter=LinkFilter(
+            verify=verify,
+            **link_filter_options(
+                arguments["--scope"],
+                arguments["--include"],
+                arguments["--exclude"],
+                arguments["--probe"],
+            ),
+        ),
+        **options,
+    )
+    try:
+        check_website(
+            crawler,
+            url,
+            label,
+            output,
+            new_path,
+            new_cache_path,
+            status_path=arguments["--status"],
+            metrics_path=arguments["--metrics"],
+        )
+    finally:
+        scheduler.shutdown()
+        dl.browser_pool.close()
+        pdf_text.cache.close()
+        dl.log_pool_stats()
 
 except Exception:
     log.exception("Error in website_matcher.py")
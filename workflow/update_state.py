@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Update the CSV and the hashes from the output of a run
+
+The error count of every website with a matches file is reset and the error
+count of every website with an error file is increased afterwards, then the
+CSV is written back in one go (sorted by label, quoted like the SQLite CSV
+export). The new hash files of the run are merged into the hash directory.
+
+Usage:
+  update_state.py --output <dir> [--csv <path>] [--hashes <dir>] [--verbose]
+  update_state.py (-h | --help)
+  update_state.py --version
+
+Options:
+  -h, --help                  Show this screen.
+  --version                   Show version.
+  -o, --output <dir>          Directory with the downloaded output (matches/, error_counts/, new_hashes/).
+  -c, --csv <path>            Path to the CSV, whose error counts are updated.
+  --hashes <dir>              Directory of the hashes, into which the new hashes are merged.
+  --verbose                   Option to enable more verbose output.
+"""  # noqa: E501
+
+
+import csv
+import glob
+import logging
+import os
+import re
+import shutil
+import string
+import sys
+import traceback
+from docopt import docopt
+from dotenv import load_dotenv, find_dotenv
+
+# fields are quoted if they are empty or contain one of these characters
+QUOTE_CHARS = re.compile(r"[^\x21-\x7e]|[\"',]")
+# COLLATE NOCASE of SQLite only folds ASCII letters
+NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def slugs(output_dir, kind, extension):
+    pattern = os.path.join(output_dir, kind, f"*{extension}")
+    return [os.path.basename(path)[: -len(extension)] for path in glob.glob(pattern)]
+
+
+def quote(value):
+    if value and not QUOTE_CHARS.search(value):
+        return value
+    return '"' + value.replace('"', '""') + '"'
+
+
+def read_csv(path):
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        return reader.fieldnames, list(reader)
+
+
+def write_csv(path, fieldnames, rows):
+    rows = sorted(rows, key=lambda r: r["label"].translate(NOCASE))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        for values in [fieldnames] + [[r[k] or "" for k in fieldnames] for r in rows]:
+            f.write(",".join(quote(v) for v in values) + "\n")
+    os.replace(tmp_path, path)
+
+
+def update_error_counts(rows, output_dir):
+    """Reset the counts of websites with matches, increase the failed ones"""
+    by_slug = {row["slug"]: row for row in rows}
+    changes = [(slug, False) for slug in slugs(output_dir, "matches", ".jsonl")]
+    changes += [(slug, True) for slug in slugs(output_dir, "error_counts", ".txt")]
+    for slug, failed in changes:
+        row = by_slug.get(slug)
+        if row is None:
+            log.debug(f"Slug '{slug}' is not in the CSV, skipping.")
+            continue
+        row["error_count"] = str(int(row["error_count"] or 0) + 1 if failed else 0)
+    return len(changes)
+
+
+def read_hashes(path):
+    try:
+        with open(path) as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def merge_hashes(output_dir, hashes_dir):
+    """Merge the new hash files into the hash directory
+
+    Text files are merged line by line, binary files already contain all
+    hashes that were loaded at the start of the run and are copied.
+    """
+    new_dir = os.path.join(output_dir, "new_hashes")
+    for slug in slugs(output_dir, "new_hashes", ".txt"):
+        path = os.path.join(hashes_dir, f"{slug}.txt")
+        hashes = read_hashes(path) | read_hashes(os.path.join(new_dir, f"{slug}.txt"))
+        with open(path, "w") as f:
+            f.write("\n".join(sorted(hashes)))
+    for slug in slugs(output_dir, "new_hashes", ".bin"):
+        shutil.copyfile(
+            os.path.join(new_dir, f"{slug}.bin"),
+            os.path.join(hashes_dir, f"{slug}.bin"),
+        )
+
+
+load_dotenv(find_dotenv())
+arguments = docopt(__doc__, version="Update state from output 1.0")
+
+loglevel = logging.INFO
+if arguments["--verbose"]:
+    loglevel = logging.DEBUG
+
+logging.basicConfig(
+    format="%(asctime)s %(levelname)-8s %(message)s",
+    level=loglevel,
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logging.captureWarnings(True)
+log = logging.getLogger(__name__)
+
+try:
+    output_dir = arguments["--output"]
+    if arguments["--csv"]:
+        fieldnames, rows = read_csv(arguments["--csv"])
+        changes = update_error_counts(rows, output_dir)
+        write_csv(arguments["--csv"], fieldnames, rows)
+        log.info(f"Updated {changes} error counts in {arguments['--csv']}")
+
+    if arguments["--hashes"]:
+        merge_hashes(output_dir, arguments["--hashes"])
+        log.info(f"Merged new hashes into {arguments['--hashes']}")
+except Exception as e:
+    print("Error: %s" % e, file=sys.stderr)
+    print(traceback.format_exc(), file=sys.stderr)
+    sys.exit(1)